@@ -6,22 +6,27 @@ delle ricette in una presentazione HTML strutturata e visivamente gradevole per
 Include la gestione di immagini, icone e fallback emoji per indicare le caratteristiche
 delle ricette.
 """
+import io
+import logging
 import os
 import base64
 from functools import lru_cache
+from html import escape
+from pathlib import Path
 
 
 from model_schema import GraphState
 
+_log = logging.getLogger(__name__)
 
-@lru_cache(maxsize=8)
+
+@lru_cache(maxsize=None)
 def get_base64_encoded_image(image_path):
     """
     Restituisce l'immagine codificata in base64 come stringa.
 
     Converte un'immagine in una stringa base64 che può essere inserita direttamente
-    nell'HTML. La funzione utilizza la cache LRU per evitare di leggere e codificare
-    ripetutamente la stessa immagine, migliorando le performance.
+    nell'HTML. Il risultato resta in cache (lru_cache) per tutta la vita del processo.
 
     Args:
         image_path: Percorso completo all'immagine da codificare.
@@ -30,14 +35,14 @@ def get_base64_encoded_image(image_path):
         str: Stringa contenente l'immagine codificata in base64 o None in caso di errore.
 
     Note:
-        - Implementata con decorator @lru_cache per memorizzare i risultati
-        - Una cache di dimensione 8 è sufficiente poiché abbiamo solo poche icone
+        - Viene chiamata una sola volta per icona (vedi _get_icon_html_dict)
     """
     try:
-        with open(image_path, "rb") as img_file:
-            return base64.b64encode(img_file.read()).decode('utf-8')
+        with open(image_path, "rb", buffering=io.DEFAULT_BUFFER_SIZE) as img_file:
+            # L'output base64 è solo ASCII: decode('ascii') usa il percorso più rapido
+            return base64.b64encode(img_file.read()).decode('ascii')
     except Exception as e:
-        print(f"Errore durante la codifica dell'immagine {image_path}: {e}")
+        _log.warning("Errore durante la codifica dell'immagine %s: %s", image_path, e)
         return None
 
 
@@ -49,6 +54,303 @@ FALLBACK_EMOJIS = {
     "lactose_free": '🥛',
 }
 
+# Cartella static risolta una sola volta dalla ROOT del progetto, così il codice
+# funziona indipendentemente da dove viene eseguito
+_STATIC_FOLDER = Path(__file__).resolve().parent.parent / "static"
+
+# Percorsi delle immagini e loro configurazione
+ICONS_CONFIG = {
+    "vegan": {"path": _STATIC_FOLDER / "vegan.png", "width": 24},
+    "vegetarian": {"path": _STATIC_FOLDER / "vegetarian_2.png", "width": 24},
+    "gluten_free": {"path": _STATIC_FOLDER / "gluten_free_2.png", "width": 24},
+    "lactose_free": {"path": _STATIC_FOLDER / "lactose_free_2.png", "width": 24},
+}
+
+
+@lru_cache(maxsize=1)
+def _get_icon_html_dict():
+    """
+    Restituisce il dizionario dei tag HTML delle icone, costruito una sola volta.
+
+    La cartella static non cambia a runtime: il primo accesso legge e codifica le
+    immagini, i successivi restituiscono il dizionario in cache senza accedere al
+    filesystem. Se l'immagine non è disponibile si usa l'emoji di fallback.
+
+    Returns:
+        dict: Chiave icona -> tag <img> in base64 oppure emoji di fallback
+    """
+    # Un solo elenco della cartella al posto di un os.path.exists per icona
+    try:
+        with os.scandir(_STATIC_FOLDER) as entries:
+            present = {entry.name for entry in entries}
+    except (FileNotFoundError, NotADirectoryError):
+        _log.warning("ATTENZIONE: La cartella static non esiste in %s", _STATIC_FOLDER)
+        return {key: FALLBACK_EMOJIS.get(key, '⚠️') for key in ICONS_CONFIG}
+
+    img_dict = {}
+    for key, config in ICONS_CONFIG.items():
+        path = config["path"]
+        base64_image = get_base64_encoded_image(
+            str(path)) if path.name in present else None
+        if base64_image:
+            img_dict[key] = f'<img src="data:image/png;base64,{base64_image}" width="{config["width"]}" style="margin-right: 5px; vertical-align: middle;">'
+        else:
+            img_dict[key] = FALLBACK_EMOJIS.get(key, '⚠️')
+    return img_dict
+
+# Template HTML precompilati: ogni ricetta/ingrediente viene reso con una sola
+# chiamata a format_map invece di concatenare molti frammenti
+_RECIPE_TMPL = (
+    "<h2>{idx}. {name}</h2>{desc_html}"
+    "<h3>Informazioni nutrizionali</h3><ul><li><b>CHO Totali:</b> {cho:.1f}g</li></ul>"
+    "{features_html}{ings_html}{instr_html}<hr>"
+)
+_INGREDIENT_TMPL = "<li><b>{name}:</b> {quantity_g:.1f}g (CHO: {cho:.1f}g{extras})</li>"
+# Frammenti HTML statici definiti una sola volta a livello di modulo
+_H_ING = "<h3>Ingredienti</h3><ul>"
+_UL_END = "</ul>"
+_H_PREP = "<h3>Preparazione</h3><ol>"
+_OL_END = "</ol>"
+_LI_FMT = "<li>{}</li>".format
+_FEATURE_ROW_START = '<div style="display: flex; align-items: center;">Caratteristiche: '
+_BR = "</div><br>"
+_TIPS_SUCCESS = "<h3>Suggerimenti</h3><p>Puoi modificare il target di carboidrati o le restrizioni dietetiche per ottenere ricette diverse.</p>"
+_TIPS_PARTIAL = "<h3>Suggerimenti</h3><p>Potresti provare a modificare leggermente il target di carboidrati o le restrizioni dietetiche per ottenere più opzioni.</p>"
+_NO_RECIPE_CAUSE = "<p><b>Possibile causa:</b> nessuna ricetta adatta è stata generata che rispetti tutti i vincoli specificati.</p>"
+_TIPS_NO_RECIPES = (
+    "<h3>Suggerimenti</h3><p>Potresti provare a:</p><ul>"
+    "<li>Modificare leggermente il target di carboidrati</li>"
+    "<li>Rimuovere alcune delle restrizioni dietetiche, se possibile</li>"
+    "<li>Verificare che i dataset degli ingredienti siano aggiornati e completi</li></ul>"
+)
+# Contributi opzionali di un ingrediente: (attributo, metodo format già legato)
+_INGREDIENT_EXTRAS = (
+    ("calories_contribution", ", Cal: {:.1f} kcal".format),
+    ("protein_contribution_g", ", Prot: {:.1f}g".format),
+    ("fat_contribution_g", ", Grassi: {:.1f}g".format),
+)
+
+# Etichette per tag dietetico canonico: le preferenze utente usano il maschile
+# ("Vegano"), le caratteristiche delle ricette il femminile ("Vegana")
+_PREFERENCE_LABELS = {
+    "vegan": "Vegano",
+    "vegetarian": "Vegetariano",
+    "gluten_free": "Senza Glutine",
+    "lactose_free": "Senza Lattosio",
+}
+_RECIPE_FEATURE_LABELS = {
+    "vegan": "Vegana",
+    "vegetarian": "Vegetariana",
+    "gluten_free": "Senza Glutine",
+    "lactose_free": "Senza Lattosio",
+}
+
+
+@lru_cache(maxsize=256)
+def _esc(text):
+    """
+    Esegue l'escape HTML di un testo generato dall'LLM.
+
+    La cache LRU evita di ripetere il lavoro per stringhe ricorrenti (nomi di
+    ingredienti comuni, ricette rigenerate nei retry) mantenendo la memoria limitata.
+    """
+    return escape(text)
+
+
+def _dietary_tags(vegan, vegetarian, gluten_free, lactose_free):
+    """
+    Calcola i tag dietetici canonici da mostrare.
+
+    Logica condivisa da preferenze utente e caratteristiche delle ricette:
+    "vegetarian" viene omesso se è presente "vegan" (vegano implica vegetariano).
+
+    Returns:
+        list: Chiavi canoniche ("vegan", "vegetarian", "gluten_free", "lactose_free")
+    """
+    tags = []
+    if vegan:
+        tags.append("vegan")
+    elif vegetarian:
+        tags.append("vegetarian")
+    if gluten_free:
+        tags.append("gluten_free")
+    if lactose_free:
+        tags.append("lactose_free")
+    return tags
+
+
+def _flag_mask(vegan, vegetarian, gluten_free, lactose_free):
+    """Codifica i quattro flag dietetici in un intero a 4 bit (indice delle tabelle di lookup)."""
+    return (vegan << 3) | (vegetarian << 2) | (gluten_free << 1) | lactose_free
+
+
+def _build_flag_table(labels):
+    """
+    Precalcola, per ognuna delle 16 combinazioni di flag, i frammenti HTML da mostrare.
+
+    La deduplicazione vegano/vegetariano è già applicata da _dietary_tags.
+
+    Args:
+        labels: Dizionario tag canonico -> etichetta testuale
+
+    Returns:
+        tuple: 16 tuple di stringhe HTML, indicizzate dalla maschera di _flag_mask
+    """
+    img_dict = _get_icon_html_dict()
+    return tuple(
+        tuple(f"{img_dict[tag]} {labels[tag]}" for tag in _dietary_tags(
+            bool(mask & 8), bool(mask & 4), bool(mask & 2), bool(mask & 1)))
+        for mask in range(16)
+    )
+
+
+
+def _format_feature_row(features):
+    """
+    Formatta una riga di caratteristiche (icone) della ricetta.
+
+    Args:
+        features: Lista di stringhe HTML rappresentanti le caratteristiche
+
+    Returns:
+        str: HTML formattato per la riga di caratteristiche o stringa vuota se non ci sono caratteristiche
+    """
+    if not features:
+        return ""
+    return _FEATURE_ROW_START + ", ".join(features) + _BR
+
+
+@lru_cache(maxsize=1)
+def _get_display_tables():
+    """
+    Restituisce le tabelle di lookup per maschera di flag, costruite una sola volta.
+
+    Contengono le righe complete delle caratteristiche (wrapper incluso) e le
+    stringhe delle preferenze: per ricetta resta un solo lookup, senza join né
+    formattazione.
+
+    Returns:
+        tuple: (righe caratteristiche ricette, stringhe preferenze utente), 16 voci ciascuna
+    """
+    feature_rows = tuple(
+        map(_format_feature_row, _build_flag_table(_RECIPE_FEATURE_LABELS)))
+    preference_strings = tuple(
+        ", ".join(prefs) if prefs else "Nessuna preferenza specifica"
+        for prefs in _build_flag_table(_PREFERENCE_LABELS))
+    return feature_rows, preference_strings
+
+
+def _format_ingredient_extras(ing):
+    """
+    Formatta i contributi opzionali (calorie, proteine, grassi) di un ingrediente.
+
+    Args:
+        ing: Oggetto CalculatedIngredient
+
+    Returns:
+        str: Frammento da inserire dopo i CHO o stringa vuota
+    """
+    # I campi sono dichiarati (default None) in CalculatedIngredient:
+    # basta un accesso diretto, senza sonde hasattr
+    extras = []
+    for attr, fmt in _INGREDIENT_EXTRAS:
+        value = getattr(ing, attr)
+        if value is not None:
+            extras.append(fmt(value))
+    return "".join(extras)
+
+
+def _format_ingredients_section(ingredients):
+    """
+    Formatta la sezione degli ingredienti di una ricetta.
+
+    Crea una lista HTML con tutti gli ingredienti e i loro contributi nutrizionali.
+
+    Args:
+        ingredients: Lista di oggetti CalculatedIngredient
+
+    Returns:
+        str: HTML formattato per la sezione ingredienti
+    """
+    # Lista preallocata: intestazione + una riga per ingrediente + chiusura
+    parts = [None] * (len(ingredients) + 2)
+    parts[0] = _H_ING
+    for i, ing in enumerate(ingredients, start=1):
+        parts[i] = _INGREDIENT_TMPL.format_map({
+            "name": _esc(ing.name),
+            "quantity_g": ing.quantity_g,
+            "cho": ing.cho_contribution,
+            "extras": _format_ingredient_extras(ing),
+        })
+    parts[-1] = _UL_END
+    return "".join(parts)
+
+
+def _format_instructions_section(instructions):
+    """
+    Formatta la sezione delle istruzioni di preparazione di una ricetta.
+
+    Crea una lista ordinata HTML con tutti i passaggi di preparazione. I passaggi
+    sono generati dall'LLM e vengono quindi sottoposti a escape HTML (_esc).
+
+    Args:
+        instructions: Lista di stringhe con i passaggi
+
+    Returns:
+        str: HTML formattato per la sezione istruzioni o stringa vuota se non ci sono istruzioni
+    """
+    if not instructions:
+        return ""
+    parts = [None] * (len(instructions) + 2)
+    parts[0] = _H_PREP
+    parts[1:-1] = map(_LI_FMT, map(_esc, instructions))
+    parts[-1] = _OL_END
+    return "".join(parts)
+
+
+def _get_feature_row(recipe):
+    """
+    Ottiene la riga HTML delle caratteristiche (icone) di una ricetta.
+
+    Le icone mostrate dipendono dai flag della ricetta, evitando ridondanze
+    (es. non mostra "vegetariano" se la ricetta è già "vegana").
+
+    Args:
+        recipe: Oggetto FinalRecipeOption
+
+    Returns:
+        str: Riga HTML precalcolata o stringa vuota se non ci sono caratteristiche
+    """
+    feature_rows, _ = _get_display_tables()
+    return feature_rows[_flag_mask(recipe.is_vegan, recipe.is_vegetarian,
+                                   recipe.is_gluten_free, recipe.is_lactose_free)]
+
+
+def _format_recipe(recipe, index):
+    """
+    Formatta una singola ricetta completa.
+
+    Combina tutte le sezioni (nome, descrizione, nutrizione, caratteristiche,
+    ingredienti, istruzioni) in un'unica presentazione HTML.
+
+    Args:
+        recipe: Oggetto FinalRecipeOption
+        index: Indice numerico della ricetta (per la numerazione)
+
+    Returns:
+        str: HTML formattato per l'intera ricetta
+    """
+    # La sezione nutrizione mostra solo i CHO totali (inclusa in _RECIPE_TMPL)
+    return _RECIPE_TMPL.format_map({
+        "idx": index,
+        "name": _esc(recipe.name),
+        "desc_html": f"<p>{_esc(recipe.description)}</p>" if recipe.description else "",
+        "cho": recipe.total_cho,
+        "features_html": _get_feature_row(recipe),
+        "ings_html": _format_ingredients_section(recipe.ingredients),
+        "instr_html": _format_instructions_section(recipe.instructions),
+    })
+
 
 def format_output_agent(state: GraphState) -> GraphState:
     """
@@ -60,7 +362,8 @@ def format_output_agent(state: GraphState) -> GraphState:
         state: Lo stato corrente del grafo, contenente le ricette verificate.
 
     Returns:
-        GraphState: Lo stato aggiornato con l'aggiunta del campo 'final_output' contenente la stringa HTML formattata.
+        GraphState: Lo stato aggiornato con l'aggiunta del campo 'final_output_parts' contenente i frammenti HTML
+        dell'output (vedi get_final_output / stream_final_output).
 
     Note:
         - Implementato con logica Python pura, non utilizza LLM
@@ -71,247 +374,106 @@ def format_output_agent(state: GraphState) -> GraphState:
         - Include gestione delle immagini con fallback a emoji
         - Organizza l'output in sezioni per una migliore leggibilità
     """
-    print("--- ESECUZIONE NODO: Formattazione Output Finale ---")
+    if _log.isEnabledFor(logging.DEBUG):
+        _log.debug("--- ESECUZIONE NODO: Formattazione Output Finale ---")
 
-    # Crea una copia profonda dello stato invece di modificarlo direttamente
-    from copy import deepcopy
-    new_state = deepcopy(state)
+    # Copia superficiale dello stato: l'unico campo scritto è 'final_output_parts',
+    # quindi non serve duplicare ricette e ingredienti annidati
+    new_state = dict(state)
 
     final_recipes = state.get('final_verified_recipes', [])
     preferences = state['user_preferences']
     error_message = state.get('error_message')
     min_recipes_required = 3  # Soglia per considerare il processo completamente riuscito
 
-    # Risolvi il percorso della cartella static dalla ROOT del progetto
-    # Questo permette al codice di funzionare indipendentemente da dove viene eseguito
-    current_dir = os.path.dirname(os.path.abspath(__file__))  # agents/
-    root_dir = os.path.dirname(current_dir)  # directory principale
-    static_folder = os.path.join(root_dir, "static")
-
-    # Verifica se la cartella static esiste
-    if not os.path.exists(static_folder):
-        print(f"ATTENZIONE: La cartella static non esiste in {static_folder}")
-
-    # Percorsi delle immagini e loro configurazione
-    icons_config = {
-        "vegan": {"path": os.path.join(static_folder, "vegan.png"), "width": 24},
-        "vegetarian": {"path": os.path.join(static_folder, "vegetarian_2.png"), "width": 24},
-        "gluten_free": {"path": os.path.join(static_folder, "gluten_free_2.png"), "width": 24},
-        "lactose_free": {"path": os.path.join(static_folder, "lactose_free_2.png"), "width": 24},
-    }
-
-    # Genera HTML per le icone
-    # Questo blocco crea un dizionario di tag HTML per ogni icona
-    # Se l'immagine non è disponibile, usa l'emoji di fallback
-    img_dict = {}
-    for key, config in icons_config.items():
-        path = config["path"]
-        width = config["width"]
-
-        if os.path.exists(path):
-            base64_image = get_base64_encoded_image(path)
-            if base64_image:
-                img_dict[key] = f'<img src="data:image/png;base64,{base64_image}" width="{width}" style="margin-right: 5px; vertical-align: middle;">'
-            else:
-                img_dict[key] = FALLBACK_EMOJIS.get(key, '⚠️')
-        else:
-            img_dict[key] = FALLBACK_EMOJIS.get(key, '⚠️')
-
-    # Funzione helper per creare righe di caratteristiche
-    def format_feature_row(features):
-        """
-        Formatta una riga di caratteristiche (icone) della ricetta.
-
-        Args:
-            features: Lista di stringhe HTML rappresentanti le caratteristiche
-
-        Returns:
-            str: HTML formattato per la riga di caratteristiche o stringa vuota se non ci sono caratteristiche
-        """
-        if not features:
-            return ""
-        row = '<div style="display: flex; align-items: center;">'
-        row += "Caratteristiche: "
-        row += ", ".join(features)
-        row += '</div><br>'
-        return row
-
     # Costruisci stringa preferenze per i messaggi
     # Questa sezione crea una rappresentazione delle preferenze dell'utente
-    prefs_list = []
-    if preferences.vegan:
-        prefs_list.append(f"{img_dict['vegan']} Vegano")
-    elif preferences.vegetarian:
-        # Mostra solo se non vegano (perché vegano implica vegetariano)
-        prefs_list.append(f"{img_dict['vegetarian']} Vegetariano")
-    if preferences.gluten_free:
-        prefs_list.append(f"{img_dict['gluten_free']} Senza Glutine")
-    if preferences.lactose_free:
-        prefs_list.append(f"{img_dict['lactose_free']} Senza Lattosio")
-    prefs_string = ", ".join(
-        prefs_list) if prefs_list else "Nessuna preferenza specifica"
-
-    # Funzione helper per creare la sezione degli ingredienti
-    def format_ingredients_section(ingredients):
-        """
-        Formatta la sezione degli ingredienti di una ricetta.
-
-        Crea una lista HTML con tutti gli ingredienti e i loro contributi nutrizionali.
-
-        Args:
-            ingredients: Lista di oggetti CalculatedIngredient
-
-        Returns:
-            str: HTML formattato per la sezione ingredienti
-        """
-        section = "<h3>Ingredienti</h3><ul>"
-        for ing in ingredients:
-            section += f"<li><b>{ing.name}:</b> {ing.quantity_g:.1f}g (CHO: {ing.cho_contribution:.1f}g"
-            if hasattr(ing, 'calories_contribution') and ing.calories_contribution is not None:
-                section += f", Cal: {ing.calories_contribution:.1f} kcal"
-            if hasattr(ing, 'protein_contribution_g') and ing.protein_contribution_g is not None:
-                section += f", Prot: {ing.protein_contribution_g:.1f}g"
-            if hasattr(ing, 'fat_contribution_g') and ing.fat_contribution_g is not None:
-                section += f", Grassi: {ing.fat_contribution_g:.1f}g"
-            section += ")</li>"
-        section += "</ul>"
-        return section
-
-    # Funzione helper per creare la sezione delle istruzioni
-    def format_instructions_section(instructions):
-        """
-        Formatta la sezione delle istruzioni di preparazione di una ricetta.
-
-        Crea una lista ordinata HTML con tutti i passaggi di preparazione.
-
-        Args:
-            instructions: Lista di stringhe con i passaggi
-
-        Returns:
-            str: HTML formattato per la sezione istruzioni o stringa vuota se non ci sono istruzioni
-        """
-        if not instructions:
-            return ""
-        section = "<h3>Preparazione</h3><ol>"
-        for step in instructions:
-            section += f"<li>{step}</li>"
-        section += "</ol>"
-        return section
-
-    # Funzione helper per creare le caratteristiche di una ricetta
-    def get_recipe_features(recipe):
-        """
-        Ottiene le caratteristiche (icone) per una ricetta.
-
-        Determina quali icone mostrare in base ai flag della ricetta, evitando
-        ridondanze (es. non mostra "vegetariano" se la ricetta è già "vegana").
-
-        Args:
-            recipe: Oggetto FinalRecipeOption
-
-        Returns:
-            list: Lista di stringhe HTML rappresentanti le caratteristiche
-        """
-        features = []
-        if recipe.is_vegan:
-            features.append(f"{img_dict['vegan']} Vegana")
-        if recipe.is_vegetarian and not recipe.is_vegan:
-            # Mostra solo se non vegano (per evitare ridondanza)
-            features.append(f"{img_dict['vegetarian']} Vegetariana")
-        if recipe.is_gluten_free:
-            features.append(f"{img_dict['gluten_free']} Senza Glutine")
-        if recipe.is_lactose_free:
-            features.append(f"{img_dict['lactose_free']} Senza Lattosio")
-        return features
-
-    # Funzione helper per la sezione di nutrizione
-    def format_nutrition_section(recipe):
-        """
-        Formatta la sezione delle informazioni nutrizionali di una ricetta.
-        Versione semplificata che mostra solo i CHO totali.
-
-        Args:
-            recipe: Oggetto FinalRecipeOption
-
-        Returns:
-            str: HTML formattato per la sezione nutrizione semplificata
-        """
-        section = "<h3>Informazioni nutrizionali</h3><ul>"
-        section += f"<li><b>CHO Totali:</b> {recipe.total_cho:.1f}g</li>"
-        # Rimuove la visualizzazione di calorie, proteine, grassi e fibre
-        section += "</ul>"
-        return section
-
-    # Funzione helper per formattare una singola ricetta
-    def format_recipe(recipe, index):
-        """
-        Formatta una singola ricetta completa.
-
-        Combina tutte le sezioni (nome, descrizione, nutrizione, caratteristiche,
-        ingredienti, istruzioni) in un'unica presentazione HTML.
-
-        Args:
-            recipe: Oggetto FinalRecipeOption
-            index: Indice numerico della ricetta (per la numerazione)
-
-        Returns:
-            str: HTML formattato per l'intera ricetta
-        """
-        output = f"<h2>{index}. {recipe.name}</h2>"
-
-        if recipe.description:
-            output += f"<p>{recipe.description}</p>"
-
-        output += format_nutrition_section(recipe)
-
-        recipe_features = get_recipe_features(recipe)
-        output += format_feature_row(recipe_features)
-
-        output += format_ingredients_section(recipe.ingredients)
-        output += format_instructions_section(recipe.instructions)
-
-        output += "<hr>"
-        return output
+    _, preference_strings = _get_display_tables()
+    prefs_string = preference_strings[_flag_mask(preferences.vegan, preferences.vegetarian,
+                                                 preferences.gluten_free, preferences.lactose_free)]
 
     # Costruisci l'output formattato
     # Questa è la logica principale che determina quale tipo di output generare
     # in base al numero di ricette trovate e agli eventuali errori
-    output_string = ""
+    # Frammenti accumulati in lista e uniti una sola volta alla fine
+    output_parts = []
 
     if final_recipes and len(final_recipes) >= min_recipes_required:
         # CASO 1: Successo - Abbiamo trovato abbastanza ricette
-        output_string += f"<h1>Ricette personalizzate</h1><p>Ecco {len(final_recipes)} proposte di ricette che soddisfano i tuoi criteri (Target CHO: ~{preferences.target_cho:.1f}g, {prefs_string}):</p><hr>"
+        output_parts.append(f"<h1>Ricette personalizzate</h1><p>Ecco {len(final_recipes)} proposte di ricette che soddisfano i tuoi criteri (Target CHO: ~{preferences.target_cho:.1f}g, {prefs_string}):</p><hr>")
 
         for i, recipe in enumerate(final_recipes):
-            output_string += format_recipe(recipe, i+1)
+            output_parts.append(_format_recipe(recipe, i+1))
 
-        output_string += "<h3>Suggerimenti</h3><p>Puoi modificare il target di carboidrati o le restrizioni dietetiche per ottenere ricette diverse.</p>"
+        output_parts.append(_TIPS_SUCCESS)
 
     elif final_recipes:  # Trovate alcune ricette ma meno del minimo richiesto
         # CASO 2: Successo parziale - Abbiamo trovato alcune ricette ma non abbastanza
-        output_string += f"<h1>Risultati parziali</h1><p>Spiacente, sono state trovate solo {len(final_recipes)} ricette che soddisfano tutti i tuoi criteri (Target CHO: ~{preferences.target_cho:.1f}g, {prefs_string}) invece delle {min_recipes_required} richieste:</p><hr>"
+        output_parts.append(f"<h1>Risultati parziali</h1><p>Spiacente, sono state trovate solo {len(final_recipes)} ricette che soddisfano tutti i tuoi criteri (Target CHO: ~{preferences.target_cho:.1f}g, {prefs_string}) invece delle {min_recipes_required} richieste:</p><hr>")
 
         for i, recipe in enumerate(final_recipes):
-            output_string += format_recipe(recipe, i+1)
+            output_parts.append(_format_recipe(recipe, i+1))
 
-        output_string += "<h3>Suggerimenti</h3><p>Potresti provare a modificare leggermente il target di carboidrati o le restrizioni dietetiche per ottenere più opzioni.</p>"
+        output_parts.append(_TIPS_PARTIAL)
 
     else:  # Nessuna ricetta trovata o errore grave precedente
         # CASO 3: Fallimento - Nessuna ricetta trovata
-        output_string += f"<h1>Nessuna ricetta trovata</h1><p>Spiacente, non è stato possibile trovare nessuna ricetta che soddisfi tutti i tuoi criteri (Target CHO: ~{preferences.target_cho:.1f}g, {prefs_string}) entro la tolleranza richiesta.</p><hr>"
+        output_parts.append(f"<h1>Nessuna ricetta trovata</h1><p>Spiacente, non è stato possibile trovare nessuna ricetta che soddisfi tutti i tuoi criteri (Target CHO: ~{preferences.target_cho:.1f}g, {prefs_string}) entro la tolleranza richiesta.</p><hr>")
 
         if error_message:
-            output_string += f"<p><b>Dettaglio problema:</b> {error_message}</p>"
+            output_parts.append(f"<p><b>Dettaglio problema:</b> {_esc(error_message)}</p>")
         else:
-            output_string += "<p><b>Possibile causa:</b> nessuna ricetta adatta è stata generata che rispetti tutti i vincoli specificati.</p>"
+            output_parts.append(_NO_RECIPE_CAUSE)
         # Potremmo rivedere i suggerimenti o  non mostrarli proprio
-        output_string += "<h3>Suggerimenti</h3><p>Potresti provare a:</p><ul>"
-        output_string += "<li>Modificare leggermente il target di carboidrati</li>"
-        output_string += "<li>Rimuovere alcune delle restrizioni dietetiche, se possibile</li>"
-        output_string += "<li>Verificare che i dataset degli ingredienti siano aggiornati e completi</li></ul>"
-    # Aggiorna lo stato con l'output formattato
-    new_state['final_output'] = output_string
-    print(
-        f"--- Formattazione completata ({len(output_string)} caratteri generati) ---")
+        output_parts.append(_TIPS_NO_RECIPES)
+
+    # Aggiorna lo stato con i frammenti dell'output: la stringa completa viene
+    # costruita solo su richiesta (get_final_output) o inviata a pezzi (stream_final_output)
+    new_state['final_output_parts'] = output_parts
+    # Un'unica riga di log finale; il guard evita anche di sommare le lunghezze
+    if _log.isEnabledFor(logging.DEBUG):
+        _log.debug("Formattazione completata: %d caratteri",
+                   sum(map(len, output_parts)))
 
     return new_state
+
+
+def stream_final_output(state: GraphState):
+    """
+    Restituisce i frammenti dell'output finale uno alla volta.
+
+    Permette a un handler web di inviare l'HTML in streaming senza
+    materializzare l'intera stringa in memoria.
+
+    Args:
+        state: Stato del grafo dopo l'esecuzione di format_output_agent.
+
+    Yields:
+        str: Frammenti HTML nell'ordine di visualizzazione.
+    """
+    final_output = state.get('final_output')
+    if final_output is not None:
+        yield final_output
+        return
+    yield from state.get('final_output_parts') or ()
+
+
+def get_final_output(state: GraphState, default: str = None):
+    """
+    Restituisce l'output finale come stringa unica, costruendola su richiesta.
+
+    Args:
+        state: Stato del grafo dopo l'esecuzione di format_output_agent.
+        default: Valore restituito se il nodo di formattazione non ha prodotto output.
+
+    Returns:
+        str: L'HTML completo, oppure default se assente.
+    """
+    if state.get('final_output') is None and state.get('final_output_parts') is None:
+        return default
+    return "".join(stream_final_output(state))
+
+
+# Pre-riscaldamento delle cache all'import: lettura e codifica delle icone
+# avvengono durante il caricamento del modulo e non alla prima richiesta
+_get_display_tables()
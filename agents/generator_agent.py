@@ -1,193 +1,453 @@
-import json
+import asyncio
+import logging
 import random
 import os
+import textwrap
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Optional
+
+import httpx
+import orjson
 
 # Import LLM e componenti Langchain
 from langchain_openai import ChatOpenAI
+from openai import OpenAI, RateLimitError
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.messages import HumanMessage, SystemMessage
 
 # Import modelli Pydantic e schema stato
-from pydantic import BaseModel, Field as PydanticField, ValidationError
-from pydantic.config import ConfigDict
-from model_schema import IngredientInfo, FinalRecipeOption, RecipeIngredient, UserPreferences, GraphState, CalculatedIngredient
+from pydantic import ValidationError
+from model_schema import FinalRecipeOption, UserPreferences, GraphState
+
+# Log dei task di generazione: eventi per ricetta a DEBUG (muti di default e
+# formattati solo se il livello è abilitato), errori e retry a WARNING
+_log = logging.getLogger(__name__)
+
+# Numero massimo di chiamate OpenAI contemporanee (limite del tier)
+_MAX_CONCURRENCY = 8
+
+# Temperatura di generazione e temperatura più alta per le ricette extra
+_GENERATION_TEMPERATURE = 0.9
+_DIVERSE_TEMPERATURE = 1.05
+
+# Limiti dell'account OpenAI per il modello di generazione (richieste e token
+# al minuto), pausa dopo un 429 e token di output stimati per ricetta
+_MAX_REQUESTS_PER_MINUTE = 3500
+_MAX_TOKENS_PER_MINUTE = 200000
+_RATE_LIMIT_COOLDOWN = 15.0
+_ESTIMATED_OUTPUT_TOKENS = 800
+
+# Retry: per ricetta, budget totale per richiesta e backoff esponenziale (secondi)
+_MAX_RETRIES_PER_RECIPE = 2
+_MAX_RETRIES_PER_REQUEST = 4
+_RETRY_BASE_DELAY = 1.0
+_RETRY_MAX_DELAY = 16.0
+
+# Batch API: finestra di completamento, polling con backoff esponenziale
+# (attesa iniziale e massima) e attesa totale (secondi) prima di annullare il
+# batch e ripiegare sulla generazione diretta. I batch spesso impiegano molto
+# più di qualche minuto: la modalità conviene solo per esecuzioni offline.
+_BATCH_COMPLETION_WINDOW = "24h"
+_BATCH_POLL_MIN_DELAY = 5
+_BATCH_POLL_MAX_DELAY = 30
+_BATCH_MAX_WAIT = 300
+
+# Client HTTP asincrono condiviso da tutte le richieste: connessioni keep-alive
+# riusate tra le chiamate e timeout per limitare la latenza di coda
+_ASYNC_HTTP_CLIENT = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=16, max_keepalive_connections=16),
+    timeout=30.0
+)
+
+# Event loop persistente in un thread di background: le connessioni del client
+# asincrono sono legate al loop, quindi tutte le generazioni girano sullo stesso
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """Restituisce l'event loop di background, avviandolo alla prima chiamata."""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever,
+                             name="recipe-gen-loop", daemon=True).start()
+            _event_loop = loop
+    return _event_loop
+
+
+def _run_async(coro):
+    """Esegue una coroutine sul loop di background e ne attende il risultato."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_event_loop()).result()
 
-# --- Modelli Pydantic per l'output dell'LLM ---
+# --- Funzione estrazione JSON ---
 
 
-class GeneratedRecipeOutput(BaseModel):
+def extract_json_substring_from_llm_response(response_str: str) -> str:
     """
-    Modello Pydantic che rappresenta il formato di output atteso da parte dell'LLM.
-
-    Include informazioni su nome, descrizione, ingredienti, caratteristiche dietetiche
-    e istruzioni per la preparazione.
+    Estrae il blocco JSON dalla risposta dell'LLM: dal primo '{' all'ultimo '}'.
+    Eventuali recinti markdown ```json restano fuori dal blocco {...}.
+    Parsing e validazione avvengono in un solo passaggio con
+    FinalRecipeOption.model_validate_json.
     """
-    model_config = ConfigDict(arbitrary_types_allowed=True)
-    recipe_name: str = PydanticField(description="Nome della ricetta generata")
-    description: str = PydanticField(
-        description="Breve descrizione", default="")
-    ingredients: list[dict] = PydanticField(
-        description="Lista ingredienti [{'name': str, 'quantity_g': float}]")
-    is_vegan: bool = PydanticField(
-        description="Flag vegano LLM", default=False)
-    is_vegetarian: bool = PydanticField(
-        description="Flag vegetariano LLM", default=False)
-    is_gluten_free: bool = PydanticField(
-        description="Flag senza glutine LLM", default=False)
-    is_lactose_free: bool = PydanticField(
-        description="Flag senza lattosio LLM", default=False)
-    instructions: list[str] = PydanticField(
-        description="Lista istruzioni", default=[])
+    start = response_str.find('{')
+    end = response_str.rfind('}')
+    if start != -1 and end > start:
+        return response_str[start:end + 1]
+    raise ValueError("Impossibile estrarre un JSON valido dalla risposta")
 
-# --- Funzione estrazione JSON ---
+# --- Preferenze dietetiche per il prompt ---
+
+# (attributo UserPreferences, etichetta nel prompt)
+_DIETARY_PREFERENCE_LABELS = (
+    ("vegan", "vegana"),
+    ("vegetarian", "vegetariana"),
+    ("gluten_free", "senza glutine"),
+    ("lactose_free", "senza lattosio"),
+)
+
+
+def build_dietary_preferences_string(preferences: UserPreferences) -> str:
+    """Costruisce la stringa delle preferenze dietetiche da inserire nel prompt."""
+    dietary_preferences = [
+        label for attr, label in _DIETARY_PREFERENCE_LABELS
+        # "vegana" implica già "vegetariana"
+        if getattr(preferences, attr)
+        and not (attr == "vegetarian" and preferences.vegan)
+    ]
+    return ", ".join(
+        dietary_preferences) if dietary_preferences else "nessuna preferenza specifica"
 
+# --- Streaming della risposta LLM ---
 
-def extract_json_from_llm_response(response_str: str) -> dict:
-    """Estrae JSON dalla risposta dell'LLM utilizzando vari metodi."""
-    if response_str.strip().startswith('{') and response_str.strip().endswith('}'):
-        try:
-            return json.loads(response_str)
-        except json.JSONDecodeError:
-            pass
-    if "```json" in response_str and "```" in response_str:
-        try:
-            start = response_str.find("```json") + 7
-            end = response_str.find("```", start)
-            if start > 6 and end > start:
-                return json.loads(response_str[start:end].strip())
-        except (json.JSONDecodeError, ValueError):
-            pass
+
+async def _stream_json_response(generator_chain: Any, inputs: dict) -> str:
+    """
+    Riceve la risposta dell'LLM in streaming seguendo la profondità delle
+    graffe (fuori dalle stringhe JSON):
+    - se il primo carattere utile non è '{' la risposta viene scartata subito
+      (ValueError) senza attendere il resto della generazione;
+    - appena l'oggetto JSON di primo livello si chiude lo stream viene chiuso
+      e il testo restituito, ignorando eventuali token successivi.
+    """
+    parts = []
+    depth = 0
+    in_string = False
+    escaped = False
+    started = False
+
+    stream = generator_chain.astream(inputs)
     try:
-        start = response_str.find('{')
-        end = response_str.rfind('}')
-        if start != -1 and end != -1 and end > start:
-            return json.loads(response_str[start:end+1])
-    except (json.JSONDecodeError, ValueError):
-        pass
-    raise ValueError("Impossibile estrarre un JSON valido dalla risposta")
+        async for chunk in stream:
+            for pos, char in enumerate(chunk):
+                if not started:
+                    if char.isspace():
+                        continue
+                    if char != '{':
+                        raise ValueError(
+                            f"Risposta non JSON: inizia con {chunk[pos:pos + 20]!r}")
+                    started = True
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif char == '\\':
+                        escaped = True
+                    elif char == '"':
+                        in_string = False
+                elif char == '"':
+                    in_string = True
+                elif char == '{':
+                    depth += 1
+                elif char == '}':
+                    depth -= 1
+                    if depth == 0:
+                        parts.append(chunk[:pos + 1])
+                        return "".join(parts)
+            parts.append(chunk)
+    finally:
+        await stream.aclose()
+
+    return "".join(parts)
 
 # --- Funzione Worker per Generare Singola Ricetta ---
 
 
-def generate_single_recipe(
-    preferences: UserPreferences,
-    generator_chain: any,
-    recipe_index: int
-) -> dict:
+def _retry_delay(attempt: int) -> float:
+    """Backoff esponenziale con full jitter: uniforme in [0, min(max, base * 2^attempt)]."""
+    return random.uniform(0, min(_RETRY_MAX_DELAY, _RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class _RateLimiter:
+    """
+    Limitatore proattivo a token bucket per richieste e token al minuto
+    (schema del cookbook OpenAI api_request_parallel_processor): la capacità
+    si ricarica in proporzione al tempo trascorso e ogni chiamata la consuma
+    prima di partire, così le generazioni si distribuiscono entro i limiti
+    dell'account invece di andare a sbattere contro i 429.
+    Usato solo dall'event loop di background, quindi senza lock.
+    """
+
+    def __init__(self, max_requests_per_minute: float, max_tokens_per_minute: float):
+        self.max_requests = max_requests_per_minute
+        self.max_tokens = max_tokens_per_minute
+        self.available_request_capacity = max_requests_per_minute
+        self.available_token_capacity = max_tokens_per_minute
+        self.last_update = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.available_request_capacity = min(
+            self.max_requests, self.available_request_capacity + self.max_requests * elapsed / 60.0)
+        self.available_token_capacity = min(
+            self.max_tokens, self.available_token_capacity + self.max_tokens * elapsed / 60.0)
+        self.last_update = now
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """Attende finché c'è capacità per una richiesta da estimated_tokens token."""
+        while True:
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            self._refill()
+            if self.available_request_capacity >= 1 and self.available_token_capacity >= estimated_tokens:
+                self.available_request_capacity -= 1
+                self.available_token_capacity -= estimated_tokens
+                return
+            # Tempo minimo perché entrambe le capacità tornino sufficienti
+            wait_requests = (1 - self.available_request_capacity) * \
+                60.0 / self.max_requests
+            wait_tokens = (estimated_tokens - self.available_token_capacity) * \
+                60.0 / self.max_tokens
+            await asyncio.sleep(max(wait_requests, wait_tokens, 0.01))
+
+    def on_rate_limit(self) -> None:
+        """Dopo un 429 azzera la capacità e sospende tutte le chiamate per un po'."""
+        self.available_request_capacity = 0
+        self.available_token_capacity = 0
+        self.last_update = time.monotonic()
+        self.paused_until = self.last_update + _RATE_LIMIT_COOLDOWN
+
+
+class _RetryBudget:
+    """
+    Budget di retry condiviso tra le ricette di una stessa richiesta: sotto
+    rate limit evita che ogni task ritenti per conto proprio. Tutti i task
+    girano sullo stesso event loop, quindi non serve un lock.
+    """
+
+    def __init__(self, total: int):
+        self.remaining = total
+
+    def take(self) -> bool:
+        """Consuma un retry; False se il budget è esaurito."""
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+
+_RATE_LIMITER = _RateLimiter(_MAX_REQUESTS_PER_MINUTE, _MAX_TOKENS_PER_MINUTE)
+
+
+def _estimated_tokens_per_call() -> int:
+    """Stima grezza dei token per chiamata: prompt (~4 caratteri/token) + output."""
+    return (len(SYSTEM_PROMPT) + len(HUMAN_PROMPT)) // 4 + _ESTIMATED_OUTPUT_TOKENS
+
+
+async def generate_single_recipe(
+    generator_chain: Any,
+    recipe_index: int,
+    retry_budget: Optional[_RetryBudget] = None
+) -> Optional[FinalRecipeOption]:
     """
     Genera una singola ricetta creativa con vincoli minimi.
     Non effettua validazione o matching degli ingredienti.
+    Target CHO e preferenze sono già legati al prompt dall'agente.
+    I retry usano backoff esponenziale con jitter e attingono a un budget
+    condiviso tra tutte le ricette della stessa richiesta.
     """
-    print(f"Thread: Generazione ricetta #{recipe_index+1}")
-
-    # Costruisci stringa preferenze
-    dietary_preferences = []
-    if preferences.vegan:
-        dietary_preferences.append("vegana")
-    elif preferences.vegetarian:
-        dietary_preferences.append("vegetariana")
-    if preferences.gluten_free:
-        dietary_preferences.append("senza glutine")
-    if preferences.lactose_free:
-        dietary_preferences.append("senza lattosio")
-    dietary_preferences_string = ", ".join(
-        dietary_preferences) if dietary_preferences else "nessuna preferenza specifica"
+    _log.debug("Task: Generazione ricetta #%d", recipe_index + 1)
 
-    # Tentativo di generazione con retry minimo
-    max_retries = 1
-    retry_delay = 1
+    max_retries = _MAX_RETRIES_PER_RECIPE
 
     for attempt in range(max_retries + 1):
         try:
-            # Esegui chain LLM
-            response_str = generator_chain.invoke({
-                "target_cho": preferences.target_cho,
-                "recipe_index": recipe_index + 1,
-                "dietary_preferences": dietary_preferences_string
+            # Attendi capacità nei limiti RPM/TPM prima di partire
+            await _RATE_LIMITER.acquire(_estimated_tokens_per_call())
+
+            # Esegui chain LLM in streaming
+            response_str = await _stream_json_response(generator_chain, {
+                "recipe_index": recipe_index + 1
             })
 
             try:
                 # Processa risposta
-                llm_output = extract_json_from_llm_response(response_str)
-                print(
-                    f"Thread: Ricetta #{recipe_index+1} JSON estratto correttamente")
-
-                # Validazione semplice della struttura JSON
-                validated_output = GeneratedRecipeOutput.model_validate(
-                    llm_output)
-
-                return {
-                    "recipe_name": validated_output.recipe_name,
-                    "description": validated_output.description,
-                    "ingredients": validated_output.ingredients,
-                    "is_vegan": validated_output.is_vegan,
-                    "is_vegetarian": validated_output.is_vegetarian,
-                    "is_gluten_free": validated_output.is_gluten_free,
-                    "is_lactose_free": validated_output.is_lactose_free,
-                    "instructions": validated_output.instructions
-                }
-
-            except (json.JSONDecodeError, ValidationError, ValueError) as json_error:
-                if attempt < max_retries:
-                    print(
-                        f"Thread: Errore JSON ricetta #{recipe_index+1}: {json_error}. Retry.")
-                    time.sleep(retry_delay)
+                json_substring = extract_json_substring_from_llm_response(
+                    response_str)
+
+                # Parsing + validazione in un solo passaggio (jiter, lato Rust),
+                # direttamente nel modello usato dal resto del workflow
+                recipe = FinalRecipeOption.model_validate_json(json_substring)
+                _log.debug(
+                    "Task: Ricetta #%d JSON estratto correttamente", recipe_index + 1)
+
+                return recipe
+
+            except (ValidationError, ValueError) as json_error:
+                if attempt < max_retries and (retry_budget is None or retry_budget.take()):
+                    _log.warning(
+                        "Task: Errore JSON ricetta #%d: %s. Retry.", recipe_index + 1, json_error)
+                    await asyncio.sleep(_retry_delay(attempt))
                     continue
-                print(
-                    f"Thread: Errore JSON definitivo ricetta #{recipe_index+1}: {json_error}")
+                _log.warning(
+                    "Task: Errore JSON definitivo ricetta #%d: %s", recipe_index + 1, json_error)
                 return None
 
         except Exception as e:
-            if attempt < max_retries:
-                print(
-                    f"Thread: Errore API ricetta #{recipe_index+1}: {e}. Retry.")
-                time.sleep(retry_delay)
+            if isinstance(e, RateLimitError):
+                _RATE_LIMITER.on_rate_limit()
+            if attempt < max_retries and (retry_budget is None or retry_budget.take()):
+                _log.warning(
+                    "Task: Errore API ricetta #%d: %s. Retry.", recipe_index + 1, e)
+                await asyncio.sleep(_retry_delay(attempt))
                 continue
-            print(
-                f"Thread: Errore API definitivo ricetta #{recipe_index+1}: {e}")
+            _log.warning(
+                "Task: Errore API definitivo ricetta #%d: %s", recipe_index + 1, e)
             return None
 
     return None  # Fallimento dopo tutti i tentativi
 
-# --- Funzione Agente Principale ---
-
 
-def generate_recipes_agent(state: GraphState) -> GraphState:
+async def _generate_raw_recipes(
+    generator_chain: Any,
+    n_recipes: int,
+    sufficient_recipes: int
+) -> list[FinalRecipeOption]:
     """
-    Node Function: Genera ricette creative con vincoli minimi.
-    Non effettua validazione o matching degli ingredienti.
+    Genera fino a n_recipes ricette con una chiamata per ricetta, in
+    concorrenza sullo stesso event loop (al massimo _MAX_CONCURRENCY chiamate
+    contemporanee), e le raccoglie in ordine di completamento. Usata per
+    completare i campioni non validi: raggiunte sufficient_recipes ricette
+    valide annulla i task rimasti, sia in coda sul semaforo sia in volo
+    (lo stream viene chiuso e i token successivi non vengono generati).
     """
-    print("--- ESECUZIONE NODO: Generazione Ricette (Semplificata) ---")
-
-    try:
-        # Recupera preferenze
-        preferences = state['user_preferences']
+    semaphore = asyncio.Semaphore(_MAX_CONCURRENCY)
+    retry_budget = _RetryBudget(_MAX_RETRIES_PER_REQUEST)
 
-        target_cho = preferences.target_cho  # Ottieni il valore
-        # TRACCIA!
-        print(f"Valore target_cho ricevuto dallo stato: {target_cho}")
+    async def run_limited(recipe_index: int) -> Optional[FinalRecipeOption]:
+        async with semaphore:
+            return await generate_single_recipe(generator_chain, recipe_index, retry_budget)
 
-        # Setup LLM, Prompt
-        target_recipes = 10  # Numero ricette da tentare
-        max_workers = 8
-        api_key = os.getenv("OPENAI_API_KEY")
+    tasks = [asyncio.create_task(run_limited(i)) for i in range(n_recipes)]
+    raw_recipes = []
 
-        if not api_key:
-            state['error_message'] = "API Key OpenAI non trovata."
-            print(f"Errore: {state['error_message']}")
-            state['generated_recipes'] = []
-            return state
-
-        model_name = "gpt-3.5-turbo"
-        print(
-            f"Utilizzo modello {model_name} per generazione ricette creative")
-        llm = ChatOpenAI(temperature=0.9, model_name=model_name,
-                         openai_api_key=api_key)
-
-        # PROMPT SEMPLIFICATO - CORRETTO
-        system_prompt = """
+    for next_done in asyncio.as_completed(tasks):
+        try:
+            result = await next_done
+        except asyncio.CancelledError:
+            continue
+        except Exception as exc:
+            _log.warning("Generazione ricetta fallita con eccezione: %s", exc)
+            continue
+
+        if result:
+            raw_recipes.append(result)
+            _log.debug("Ricetta '%s' aggiunta.", result.name)
+            if len(raw_recipes) == sufficient_recipes:
+                cancelled = sum(task.cancel() for task in tasks)
+                if cancelled:
+                    _log.debug(
+                        "Raggiunte %d ricette: annullate %d generazioni in eccesso.", sufficient_recipes, cancelled)
+
+    return raw_recipes
+
+async def _generate_samples(llm: ChatOpenAI, messages: list, n_samples: int) -> list[FinalRecipeOption]:
+    """
+    Una sola chiamata chat completions con n campioni indipendenti: il prompt
+    viaggia e viene fatturato una volta sola invece che per ogni ricetta.
+    Restituisce le ricette valide tra i campioni ricevuti.
+    """
+    await _RATE_LIMITER.acquire(
+        _estimated_tokens_per_call() + (n_samples - 1) * _ESTIMATED_OUTPUT_TOKENS)
+    try:
+        result = await llm.agenerate(
+            [messages], response_format=_RECIPE_RESPONSE_FORMAT)
+    except Exception as e:
+        if isinstance(e, RateLimitError):
+            _RATE_LIMITER.on_rate_limit()
+        _log.warning("Task: Errore API generazione di %d campioni: %s", n_samples, e)
+        return []
+
+    recipes = []
+    for sample_index, generation in enumerate(result.generations[0]):
+        try:
+            recipes.append(FinalRecipeOption.model_validate_json(
+                extract_json_substring_from_llm_response(generation.text)))
+        except (ValidationError, ValueError) as json_error:
+            _log.warning("Task: Errore JSON campione #%d: %s", sample_index + 1, json_error)
+    return recipes
+
+
+async def _generate_raw_recipes_multi_sample(
+    model_name: str,
+    api_key: str,
+    target_cho: str,
+    dietary_preferences: str,
+    target_recipes: int,
+    sufficient_recipes: int,
+    generator_chain: Any
+) -> list[FinalRecipeOption]:
+    """
+    Genera le ricette con due chiamate n-campioni in parallelo invece di una
+    chiamata per ricetta: sufficient_recipes campioni alla temperatura di
+    generazione e i restanti alla temperatura più alta per la varietà.
+    Se le ricette valide non bastano, completa con la generazione per singola
+    ricetta (che ha retry e backoff).
+    """
+    prompt_variables = {
+        "target_cho": target_cho,
+        "dietary_preferences": dietary_preferences
+    }
+    # Tutti i campioni condividono lo stesso prompt: l'indice resta fisso
+    messages = [
+        SystemMessage(content=SYSTEM_PROMPT.format(**prompt_variables)),
+        HumanMessage(content=HUMAN_PROMPT.format(
+            recipe_index=1, **prompt_variables))
+    ]
+    sample_groups = [(_GENERATION_TEMPERATURE, sufficient_recipes),
+                     (_DIVERSE_TEMPERATURE, target_recipes - sufficient_recipes)]
+    results = await asyncio.gather(*(
+        _generate_samples(_build_sampling_llm(model_name, temperature, api_key, n_samples),
+                          messages, n_samples)
+        for temperature, n_samples in sample_groups if n_samples > 0))
+    raw_recipes = [recipe for group in results for recipe in group]
+    for recipe in raw_recipes:
+        _log.debug("Ricetta '%s' aggiunta.", recipe.name)
+
+    shortfall = sufficient_recipes - len(raw_recipes)
+    if shortfall > 0:
+        # Sovra-provisioning fino a target_recipes: le generazioni di margine
+        # vengono annullate appena le ricette valide bastano
+        n_top_up = target_recipes - len(raw_recipes)
+        _log.warning(
+            "Solo %d ricette valide dai campioni: ne genero singolarmente fino a %d (ne bastano %d).",
+            len(raw_recipes), n_top_up, shortfall)
+        raw_recipes.extend(await _generate_raw_recipes(generator_chain, n_top_up, shortfall))
+    return raw_recipes
+
+# --- Prompt e costruzione della chain ---
+
+# PROMPT SEMPLIFICATO - CORRETTO
+# I prompt sono de-indentati: l'indentazione del sorgente costerebbe token a
+# ogni chiamata. Con l'output strutturato il recinto ```json non serve più.
+SYSTEM_PROMPT = textwrap.dedent("""
         **RUOLO**:  Sei uno chef creativo esperto nella creazione di ricette originali e gustose.
 
         **COMPITO**: Genera una ricetta PER UNA PERSONA che abbia ESATTAMENTE {target_cho}g di carboidrati totali (questo è ASSOLUTAMENTE CRITICO).
@@ -211,7 +471,6 @@ def generate_recipes_agent(state: GraphState) -> GraphState:
 
         Fornisci la ricetta nel seguente formato JSON:
 
-        ```json
         {{
         "recipe_name": "Nome Creativo della Ricetta",
         "description": "Breve descrizione accattivante del piatto",
@@ -228,10 +487,9 @@ def generate_recipes_agent(state: GraphState) -> GraphState:
             "Passo 2: Altra istruzione."
         ]
         }}
-        ```
-        """
+        """).strip()
 
-        human_prompt = """
+HUMAN_PROMPT = textwrap.dedent("""
         Genera la ricetta {recipe_index} che DEVE contenere ESATTAMENTE {target_cho}g di carboidrati totali.
         Ricorda:
         - Il target CHO di {target_cho}g è ASSOLUTAMENTE CRITICO
@@ -239,93 +497,242 @@ def generate_recipes_agent(state: GraphState) -> GraphState:
         - Seleziona attentamente gli ingredienti e le loro quantità per raggiungere questo target
 
         Sii creativo e proponi un piatto originale, gustoso e realizzabile.
-        """
+        """).strip()
+
+
+# Schema JSON della ricetta per l'output strutturato di OpenAI (strict: tutti i
+# campi obbligatori, nessun campo extra). Rispecchia il formato del SYSTEM_PROMPT.
+_RECIPE_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "recipe_name": {"type": "string"},
+        "description": {"type": "string"},
+        "ingredients": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "quantity_g": {"type": "number"}
+                },
+                "required": ["name", "quantity_g"],
+                "additionalProperties": False
+            }
+        },
+        "is_vegan": {"type": "boolean"},
+        "is_vegetarian": {"type": "boolean"},
+        "is_gluten_free": {"type": "boolean"},
+        "is_lactose_free": {"type": "boolean"},
+        "instructions": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["recipe_name", "description", "ingredients", "is_vegan",
+                 "is_vegetarian", "is_gluten_free", "is_lactose_free", "instructions"],
+    "additionalProperties": False
+}
+
+_RECIPE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "recipe", "strict": True, "schema": _RECIPE_JSON_SCHEMA}
+}
+
+
+@lru_cache(maxsize=8)
+def _build_json_llm(model_name: str, temperature: float, api_key: str):
+    """
+    Crea (una volta per combinazione) il modello chat con output strutturato:
+    l'API restituisce sempre un oggetto JSON conforme allo schema della ricetta,
+    quindi la validazione passa al primo tentativo e spariscono i retry per
+    JSON rotto o campi mancanti.
+    """
+    llm = ChatOpenAI(temperature=temperature, model_name=model_name,
+                     openai_api_key=api_key, http_async_client=_ASYNC_HTTP_CLIENT)
+    return llm.bind(response_format=_RECIPE_RESPONSE_FORMAT)
 
-        prompt = ChatPromptTemplate.from_messages(
-            [("system", system_prompt), ("human", human_prompt)])
-        generator_chain = prompt | llm | StrOutputParser()
 
-        print(
-            f"Avvio generazione di {target_recipes} ricette creative con {max_workers} worker paralleli...")
-        raw_recipes = []
+@lru_cache(maxsize=8)
+def _build_sampling_llm(model_name: str, temperature: float, api_key: str, n_samples: int):
+    """Crea (una volta per combinazione) il modello chat che restituisce n_samples completamenti per chiamata."""
+    return ChatOpenAI(temperature=temperature, model_name=model_name, openai_api_key=api_key,
+                      n=n_samples, http_async_client=_ASYNC_HTTP_CLIENT)
+
+
+@lru_cache(maxsize=32)
+def _build_generator_chain(model_name: str, temperature: float, api_key: str,
+                           target_cho: str, dietary_preferences: str):
+    """
+    Costruisce la chain prompt | llm | parser per una combinazione di
+    target CHO e preferenze. Le variabili invarianti sono legate al prompt:
+    ai worker resta da passare solo l'indice della ricetta. Il messaggio di
+    sistema non dipende dall'indice e viene renderizzato una sola volta.
+    """
+    prompt_variables = {
+        "target_cho": target_cho,
+        "dietary_preferences": dietary_preferences
+    }
+    system_message = SystemMessage(
+        content=SYSTEM_PROMPT.format(**prompt_variables))
+    prompt = ChatPromptTemplate.from_messages(
+        [system_message, ("human", HUMAN_PROMPT)]).partial(**prompt_variables)
+    return prompt | _build_json_llm(model_name, temperature, api_key) | StrOutputParser()
+
+
+def _generate_raw_recipes_batch(model_name: str, api_key: str, target_recipes: int,
+                                target_cho: str, dietary_preferences: str) -> list[FinalRecipeOption]:
+    """
+    Genera le ricette con la Batch API di OpenAI: un file JSONL con una richiesta
+    per ricetta, caricato e sottomesso in un unico batch (costo dimezzato e
+    limiti di rate separati). Attende il completamento con polling e passa ogni
+    risposta alla stessa validazione del percorso concorrente.
+    """
+    prompt_variables = {
+        "target_cho": target_cho,
+        "dietary_preferences": dietary_preferences
+    }
+    system_content = SYSTEM_PROMPT.format(**prompt_variables)
+    batch_lines = []
+    for recipe_index in range(target_recipes):
+        batch_lines.append(orjson.dumps({
+            "custom_id": f"rec-{recipe_index}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model_name,
+                "temperature": _GENERATION_TEMPERATURE,
+                "response_format": _RECIPE_RESPONSE_FORMAT,
+                "messages": [
+                    {"role": "system", "content": system_content},
+                    {"role": "user", "content": HUMAN_PROMPT.format(
+                        recipe_index=recipe_index + 1, **prompt_variables)}
+                ]
+            }
+        }))
+
+    client = OpenAI(api_key=api_key)
+    batch_file = client.files.create(
+        file=("recipes_batch.jsonl", b"\n".join(batch_lines)),
+        purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_file.id, endpoint="/v1/chat/completions",
+        completion_window=_BATCH_COMPLETION_WINDOW)
+    _log.info("Batch %s sottomesso con %d richieste", batch.id, target_recipes)
+
+    deadline = time.monotonic() + _BATCH_MAX_WAIT
+    poll_delay = _BATCH_POLL_MIN_DELAY
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            _log.warning("Batch %s non completato entro %ds: annullato", batch.id, _BATCH_MAX_WAIT)
+            client.batches.cancel(batch.id)
+            return []
+        time.sleep(min(poll_delay, remaining))
+        poll_delay = min(_BATCH_POLL_MAX_DELAY, poll_delay * 2)
+        batch = client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        _log.info("Batch %s: stato %s, %d/%d richieste completate",
+                  batch.id, batch.status, counts.completed if counts else 0, target_recipes)
+
+    if batch.status != "completed" or not batch.output_file_id:
+        _log.warning("Batch %s terminato senza risultati (stato %s)", batch.id, batch.status)
+        return []
+
+    raw_recipes = []
+    output_bytes = client.files.content(batch.output_file_id).content
+    for line in output_bytes.splitlines():
+        if not line.strip():
+            continue
+        result = orjson.loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            _log.warning("Richiesta %s fallita: %s", result.get('custom_id'), result.get('error'))
+            continue
+        try:
+            content = response["body"]["choices"][0]["message"]["content"]
+            recipe = FinalRecipeOption.model_validate_json(
+                extract_json_substring_from_llm_response(content))
+        except (KeyError, IndexError, ValidationError, ValueError) as json_error:
+            _log.warning("Errore JSON per %s: %s", result.get('custom_id'), json_error)
+            continue
+        raw_recipes.append(recipe)
+        _log.debug("Ricetta '%s' aggiunta dal batch.", recipe.name)
+
+    return raw_recipes
+
+# --- Funzione Agente Principale ---
+
+
+def generate_recipes_agent(state: GraphState) -> GraphState:
+    """
+    Node Function: Genera ricette creative con vincoli minimi.
+    Non effettua validazione o matching degli ingredienti.
+    """
+    _log.info("--- ESECUZIONE NODO: Generazione Ricette (Semplificata) ---")
+
+    try:
+        # Recupera preferenze
+        preferences = state['user_preferences']
+
+        target_cho = preferences.target_cho  # Ottieni il valore
+        # TRACCIA!
+        _log.debug("Valore target_cho ricevuto dallo stato: %s", target_cho)
 
-        # Esecuzione Parallela (semplificata)
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [
-                executor.submit(
-                    generate_single_recipe,  # Funzione worker
-                    preferences,            # Preferenze
-                    generator_chain,        # Chain LLM
-                    i                       # Indice ricetta
-                ) for i in range(target_recipes)
-            ]
-
-            # Raccolta Risultati
-            for future in futures:
-                try:
-                    result = future.result()
-                    if result:
-                        raw_recipes.append(result)
-                        print(f"Ricetta '{result['recipe_name']}' aggiunta.")
-                except Exception as exc:
-                    print(f"Generazione ricetta fallita con eccezione: {exc}")
-
-        # Conversione in ricette non verificate per il prossimo step
-        unverified_recipes = []
-        for raw_recipe in raw_recipes:
+        # Setup LLM, Prompt
+        target_recipes = 10  # Numero ricette da tentare
+        # Ricette raw sufficienti: sotto questa soglia i campioni mancanti
+        # vengono completati singolarmente e, raggiunta la soglia, le
+        # generazioni ancora in corso vengono annullate (margine per gli
+        # scarti del verificatore)
+        sufficient_recipes = 8
+        api_key = os.getenv("OPENAI_API_KEY")
+
+        if not api_key:
+            state['error_message'] = "API Key OpenAI non trovata."
+            _log.error("Errore: %s", state['error_message'])
+            state['generated_recipes'] = []
+            return state
+
+        # gpt-4o-mini: costo per token inferiore a gpt-3.5-turbo, JSON strutturato più affidabile
+        model_name = "gpt-4o-mini"
+        _log.info("Utilizzo modello %s per generazione ricette creative", model_name)
+
+        # Chain memorizzata per (modello, temperatura, target, preferenze):
+        # template e client vengono costruiti solo alla prima richiesta uguale.
+        # Serve per completare singolarmente le ricette mancanti
+        dietary_preferences_string = build_dietary_preferences_string(
+            preferences)
+        generator_chain = _build_generator_chain(
+            model_name, _GENERATION_TEMPERATURE, api_key,
+            str(target_cho), dietary_preferences_string)
+
+        raw_recipes = []
+        if preferences.use_batch_api:
+            # Percorso Batch API: a costo dimezzato ma pensato per esecuzioni
+            # offline; oltre _BATCH_MAX_WAIT si ripiega sulla generazione diretta
+            _log.info(
+                "Avvio generazione di %d ricette creative tramite Batch API...", target_recipes)
             try:
-                # Converti la struttura raw in CalculatedIngredient direttamente (non RecipeIngredient)
-                calculated_ingredients = []
-                for ing_data in raw_recipe["ingredients"]:
-                    # Gestisci sia "quantity_g" che possibili alternative
-                    quantity = None
-                    if "quantity_g" in ing_data:
-                        quantity = float(ing_data["quantity_g"])
-                    elif "quantity" in ing_data:
-                        quantity = float(ing_data["quantity"])
-                    elif "amount_g" in ing_data:
-                        quantity = float(ing_data["amount_g"])
-                    else:
-                        # Default se non trovata
-                        quantity = 0.0
-
-                    # Crea CalculatedIngredient invece di RecipeIngredient
-                    calculated_ingredients.append(
-                        CalculatedIngredient(
-                            name=ing_data["name"],
-                            quantity_g=quantity,
-                            cho_per_100g=None,
-                            cho_contribution=None,
-                            original_llm_name=ing_data["name"]
-                        )
-                    )
-
-                # Crea FinalRecipeOption con CalculatedIngredient
-                recipe = FinalRecipeOption(
-                    name=raw_recipe["recipe_name"],
-                    description=raw_recipe.get("description", ""),
-                    # Ora sono CalculatedIngredient, non RecipeIngredient
-                    ingredients=calculated_ingredients,
-                    total_cho=None,  # Da calcolare nel verificatore
-                    total_calories=None,
-                    total_protein_g=None,
-                    total_fat_g=None,
-                    total_fiber_g=None,
-                    is_vegan=raw_recipe.get("is_vegan", False),
-                    is_vegetarian=raw_recipe.get("is_vegetarian", False),
-                    is_gluten_free=raw_recipe.get("is_gluten_free", False),
-                    is_lactose_free=raw_recipe.get("is_lactose_free", False),
-                    instructions=raw_recipe.get("instructions", [])
-                )
-                unverified_recipes.append(recipe)
-                print(
-                    f"Conversione riuscita per ricetta '{recipe.name}' con {len(calculated_ingredients)} ingredienti")
-            except Exception as e:
-                print(
-                    f"Errore nella conversione della ricetta '{raw_recipe.get('recipe_name', 'sconosciuta')}': {e}")
-
-        print(
-            f"--- Generazione completata. Ricette raw generate: {len(unverified_recipes)} ---")
+                raw_recipes = _generate_raw_recipes_batch(
+                    model_name, api_key, target_recipes,
+                    str(target_cho), dietary_preferences_string)
+            except Exception as batch_error:
+                _log.warning("Errore Batch API: %s", batch_error)
+            if not raw_recipes:
+                _log.warning("Batch API senza ricette valide: passo alla generazione diretta.")
+
+        if not raw_recipes:
+            _log.info(
+                "Avvio generazione di %d ricette creative in due chiamate multi-campione...", target_recipes)
+
+            # Chiamate sull'event loop condiviso (carico I/O-bound)
+            raw_recipes = _run_async(_generate_raw_recipes_multi_sample(
+                model_name, api_key, str(target_cho), dietary_preferences_string,
+                target_recipes, sufficient_recipes, generator_chain))
+
+        # Le ricette arrivano già come FinalRecipeOption non verificate
+        # (totali nutrizionali calcolati dal verificatore)
+        unverified_recipes = raw_recipes
+
+        _log.info(
+            "--- Generazione completata. Ricette raw generate: %d ---", len(unverified_recipes))
         state['generated_recipes'] = unverified_recipes
 
         if not unverified_recipes:
@@ -337,9 +744,7 @@ def generate_recipes_agent(state: GraphState) -> GraphState:
         return state
 
     except Exception as ex:
-        print(f"Errore imprevisto durante la generazione: {ex}")
-        import traceback
-        traceback.print_exc()
+        _log.exception("Errore imprevisto durante la generazione: %s", ex)
         state['error_message'] = f"Errore imprevisto durante la generazione ricette: {ex}"
         state['generated_recipes'] = []
         return state
@@ -9,13 +9,19 @@ i requisiti nutrizionali e dietetici.
 from typing import List, Dict, Optional, Tuple, Union
 from copy import deepcopy
 from enum import Enum, auto
+from itertools import islice
+from difflib import get_close_matches
+import heapq
+import logging
 import random
-from ingredient_synonyms import FALLBACK_MAPPING
+from ingredient_synonyms import FALLBACK_MAPPING, is_incompatible_match
 
 
 from model_schema import GraphState, FinalRecipeOption, UserPreferences, RecipeIngredient, IngredientInfo, CalculatedIngredient
 from utils import find_best_match_faiss, calculate_ingredient_cho_contribution
 
+_log = logging.getLogger(__name__)
+
 # -- Refactor ---
 
 # --- CLASSI DI SUPPORTO PER OTTIMIZZAZIONE ---
@@ -75,11 +81,13 @@ def classify_ingredients_by_cho(recipe: FinalRecipeOption) -> Dict[str, List[Cal
         return classified
 
     for ing in recipe.ingredients:
-        if not hasattr(ing, 'cho_contribution') or ing.cho_contribution is None:
+        # cho_contribution è sempre dichiarato in CalculatedIngredient (default None)
+        cho_contribution = ing.cho_contribution
+        if cho_contribution is None:
             classified['non_cho'].append(ing)
             continue
 
-        cho_percent = (ing.cho_contribution / total_cho) * 100
+        cho_percent = (cho_contribution / total_cho) * 100
 
         if cho_percent > 30:
             classified['primary'].append(ing)
@@ -100,6 +108,26 @@ def classify_ingredients_by_cho(recipe: FinalRecipeOption) -> Dict[str, List[Cal
     return classified
 
 
+def _nutrition_totals(ingredients: List[CalculatedIngredient]) -> Tuple[float, float, float, float, float]:
+    """
+    Totali di CHO, calorie, proteine, grassi e fibre in un solo passaggio
+    sulla lista ingredienti (i contributi None vengono ignorati).
+    """
+    total_cho = total_calories = total_protein = total_fat = total_fiber = 0
+    for ing in ingredients:
+        if ing.cho_contribution is not None:
+            total_cho += ing.cho_contribution
+        if ing.calories_contribution is not None:
+            total_calories += ing.calories_contribution
+        if ing.protein_contribution_g is not None:
+            total_protein += ing.protein_contribution_g
+        if ing.fat_contribution_g is not None:
+            total_fat += ing.fat_contribution_g
+        if ing.fiber_contribution_g is not None:
+            total_fiber += ing.fiber_contribution_g
+    return total_cho, total_calories, total_protein, total_fat, total_fiber
+
+
 def recalculate_nutrition(recipe: FinalRecipeOption,
                           ingredient_data: Dict[str, IngredientInfo]) -> FinalRecipeOption:
     """
@@ -123,25 +151,9 @@ def recalculate_nutrition(recipe: FinalRecipeOption,
     updated_recipe.ingredients = updated_ingredients
 
     # Aggiorna i totali
-    updated_recipe.total_cho = sum(
-        ing.cho_contribution for ing in updated_ingredients
-        if ing.cho_contribution is not None)
-
-    updated_recipe.total_calories = sum(
-        ing.calories_contribution for ing in updated_ingredients
-        if ing.calories_contribution is not None)
-
-    updated_recipe.total_protein_g = sum(
-        ing.protein_contribution_g for ing in updated_ingredients
-        if ing.protein_contribution_g is not None)
-
-    updated_recipe.total_fat_g = sum(
-        ing.fat_contribution_g for ing in updated_ingredients
-        if ing.fat_contribution_g is not None)
-
-    updated_recipe.total_fiber_g = sum(
-        ing.fiber_contribution_g for ing in updated_ingredients
-        if ing.fiber_contribution_g is not None)
+    (updated_recipe.total_cho, updated_recipe.total_calories,
+     updated_recipe.total_protein_g, updated_recipe.total_fat_g,
+     updated_recipe.total_fiber_g) = _nutrition_totals(updated_ingredients)
 
     return updated_recipe
 
@@ -538,18 +550,17 @@ def optimize_recipe_cho(recipe: FinalRecipeOption,
     """
     # Controllo iniziale
     if recipe.total_cho is None:
-        print(
-            f"Impossibile ottimizzare: CHO totale non calcolato per '{recipe.name}'")
+        _log.warning("Impossibile ottimizzare: CHO totale non calcolato per '%s'", recipe.name)
         return recipe
 
     # Se già nel range, non c'è bisogno di ottimizzazione
     if abs(recipe.total_cho - target_cho) <= tolerance:
-        print(
-            f"Ricetta '{recipe.name}' già nel range target (CHO: {recipe.total_cho:.1f}g, Target: {target_cho:.1f}g)")
+        _log.debug(
+            "Ricetta '%s' già nel range target (CHO: %.1fg, Target: %.1fg)", recipe.name, recipe.total_cho, target_cho)
         return recipe
 
-    print(
-        f"Ottimizzazione ricetta '{recipe.name}' - CHO attuale: {recipe.total_cho:.1f}g, Target: {target_cho:.1f}g")
+    _log.info(
+        "Ottimizzazione ricetta '%s' - CHO attuale: %.1fg, Target: %.1fg", recipe.name, recipe.total_cho, target_cho)
 
     # Copia ricetta originale per confronto
     original_recipe = deepcopy(recipe)
@@ -562,31 +573,31 @@ def optimize_recipe_cho(recipe: FinalRecipeOption,
 
     # Strategia 1: Per piccole differenze, prova ottimizzazione di un singolo ingrediente
     if abs(cho_difference) < 15:
-        print("Strategie 1: Ottimizzazione singolo ingrediente")
+        _log.debug("Strategie 1: Ottimizzazione singolo ingrediente")
         result = optimize_single_ingredient(
             recipe, target_cho, ingredient_data)
         if result.success and result.cho_improvement > best_improvement:
             best_recipe = result.recipe
             best_improvement = result.cho_improvement
-            print(f"Miglioramento con singolo ingrediente: {result.message}")
+            _log.debug("Miglioramento con singolo ingrediente: %s", result.message)
 
     # Strategia 2: Per differenze moderate, prova scala proporzionale
     if difference_percentage < 40:
-        print("Strategia 2: Scaling proporzionale")
+        _log.debug("Strategia 2: Scaling proporzionale")
         result = optimize_proportionally(recipe, target_cho, ingredient_data)
         if result.success and result.cho_improvement > best_improvement:
             best_recipe = result.recipe
             best_improvement = result.cho_improvement
-            print(f"Miglioramento con scaling proporzionale: {result.message}")
+            _log.debug("Miglioramento con scaling proporzionale: %s", result.message)
 
     # Strategia 3: Per grandi differenze, prova approccio a cascata
     if difference_percentage >= 25:
-        print("Strategia 3: Ottimizzazione a cascata")
+        _log.debug("Strategia 3: Ottimizzazione a cascata")
         result = optimize_cascade(recipe, target_cho, ingredient_data)
         if result.success and result.cho_improvement > best_improvement:
             best_recipe = result.recipe
             best_improvement = result.cho_improvement
-            print(f"Miglioramento con cascata: {result.message}")
+            _log.debug("Miglioramento con cascata: %s", result.message)
 
     # Verifica finale
     best_cho = best_recipe.total_cho if best_recipe.total_cho is not None else 0
@@ -596,43 +607,68 @@ def optimize_recipe_cho(recipe: FinalRecipeOption,
     if best_improvement > 0 and abs(original_cho - best_cho) > 10:
         best_recipe.name = f"{recipe.name} (Ottimizzata)"
 
-    print(f"Risultato ottimizzazione CHO: {original_cho:.1f}g → {best_cho:.1f}g " +
-          f"(Target: {target_cho:.1f}g, Miglioramento: {best_improvement:.1f}g)")
+    _log.info(
+        "Risultato ottimizzazione CHO: %.1fg → %.1fg (Target: %.1fg, Miglioramento: %.1fg)", original_cho, best_cho, target_cho, best_improvement)
 
     return best_recipe
 
 # --- FUNZIONI DI OTTIMIZZAZIONE ---
 
 
-def calculate_recipe_similarity(recipe1: FinalRecipeOption, recipe2: FinalRecipeOption) -> float:
+# Parole comuni escluse dal confronto dei titoli
+_TITLE_STOPWORDS = frozenset({"con", "e", "al", "di", "la", "il",
+                              "le", "i", "in", "del", "della", "allo", "alla"})
+
+# Categorie di piatto per parole chiave (l'ordine delle categorie conta)
+_DISH_CATEGORIES = {
+    "primo": {"pasta", "risotto", "zuppa", "minestra", "minestrone", "gnocchi", "spaghetti", "lasagne", "riso"},
+    "secondo": {"pollo", "manzo", "tacchino", "vitello", "bistecca", "pesce", "salmone", "tonno", "frittata", "uova", "polpette"},
+    "contorno": {"insalata", "verdure", "vegetali", "patate", "legumi"},
+    "dessert": {"torta", "dolce", "gelato", "budino", "crema", "crostata"}
+}
+
+
+def _get_dish_type(recipe: FinalRecipeOption) -> str:
+    """Tipo di piatto dal nome della ricetta o, in mancanza, dagli ingredienti."""
+    name_lower = recipe.name.lower()
+    for category, keywords in _DISH_CATEGORIES.items():
+        for keyword in keywords:
+            if keyword in name_lower:
+                return category
+    # Controlla anche gli ingredienti
+    ingredients_text = " ".join(
+        [ing.name for ing in recipe.ingredients]).lower()
+    for category, keywords in _DISH_CATEGORIES.items():
+        for keyword in keywords:
+            if keyword in ingredients_text:
+                return category
+    return "unknown"
+
+
+def _recipe_similarity_features(recipe: FinalRecipeOption) -> tuple:
     """
-    Calcola un punteggio di somiglianza tra due ricette basato su vari fattori.
-
-    Criteri di similarità (con pesi differenti):
-    1. Somiglianza nel titolo (peso: 0.2) - escluse parole comuni
-    2. Ingredienti principali condivisi (peso: 0.4) - top 3 per quantità
-    3. Tipo di piatto basato su parole chiave (peso: 0.25)
-    4. Attributi dietetici comuni (peso: 0.15) - vegano, vegetariano, ecc.
-
-    Args:
-        recipe1, recipe2: Le ricette da confrontare
-
-    Returns:
-        Punteggio da 0.0 (completamente diverse) a 1.0 (identiche)
+    Estrae una volta per ricetta le caratteristiche usate dalla similarità:
+    parole del titolo, ingredienti principali (top 3 per grammi), tipo di
+    piatto e flag dietetici.
     """
+    title_words = set(recipe.name.lower().split()) - _TITLE_STOPWORDS
+    top_ingredients = heapq.nlargest(
+        3, recipe.ingredients, key=lambda x: x.quantity_g)
+    main_ingredients = {ing.name for ing in top_ingredients}
+    dietary_attrs = (recipe.is_vegan, recipe.is_vegetarian,
+                     recipe.is_gluten_free, recipe.is_lactose_free)
+    return title_words, main_ingredients, _get_dish_type(recipe), dietary_attrs
+
+
+def _similarity_from_features(features1: tuple, features2: tuple) -> float:
+    """Punteggio di similarità a partire da caratteristiche già estratte."""
+    title1_words, main_ingredients1, dish_type1, dietary_attrs1 = features1
+    title2_words, main_ingredients2, dish_type2, dietary_attrs2 = features2
     similarity_score = 0.0
     total_weight = 0.0
 
     # 1. Somiglianza nel titolo (peso: 0.2)
     weight = 0.2
-    title1_words = set(recipe1.name.lower().split())
-    title2_words = set(recipe2.name.lower().split())
-    # Rimuovi parole comuni
-    common_words = {"con", "e", "al", "di", "la", "il",
-                    "le", "i", "in", "del", "della", "allo", "alla"}
-    title1_words = title1_words - common_words
-    title2_words = title2_words - common_words
-
     if title1_words and title2_words:  # Evita divisione per zero
         title_overlap = len(title1_words.intersection(
             title2_words)) / min(len(title1_words), len(title2_words))
@@ -641,16 +677,6 @@ def calculate_recipe_similarity(recipe1: FinalRecipeOption, recipe2: FinalRecipe
 
     # 2. Ingredienti principali (peso: 0.4)
     weight = 0.4
-    # Estrai gli ingredienti principali (top 3 per grammi)
-
-    def get_main_ingredients(recipe):
-        sorted_ingredients = sorted(
-            recipe.ingredients, key=lambda x: x.quantity_g, reverse=True)
-        return {ing.name for ing in sorted_ingredients[:3]}
-
-    main_ingredients1 = get_main_ingredients(recipe1)
-    main_ingredients2 = get_main_ingredients(recipe2)
-
     if main_ingredients1 and main_ingredients2:
         ingredients_overlap = len(main_ingredients1.intersection(
             main_ingredients2)) / min(len(main_ingredients1), len(main_ingredients2))
@@ -659,43 +685,12 @@ def calculate_recipe_similarity(recipe1: FinalRecipeOption, recipe2: FinalRecipe
 
     # 3. Tipo di piatto basato su parole chiave (peso: 0.25)
     weight = 0.25
-    dish_categories = {
-        "primo": {"pasta", "risotto", "zuppa", "minestra", "minestrone", "gnocchi", "spaghetti", "lasagne", "riso"},
-        "secondo": {"pollo", "manzo", "tacchino", "vitello", "bistecca", "pesce", "salmone", "tonno", "frittata", "uova", "polpette"},
-        "contorno": {"insalata", "verdure", "vegetali", "patate", "legumi"},
-        "dessert": {"torta", "dolce", "gelato", "budino", "crema", "crostata"}
-    }
-
-    def get_dish_type(recipe: FinalRecipeOption):  # Accetta l'intero oggetto
-
-        name_lower = recipe.name.lower()
-        for category, keywords in dish_categories.items():
-            for keyword in keywords:
-                if keyword in name_lower:
-                    return category
-        # Controlla anche gli ingredienti
-        ingredients_text = " ".join([ing.name.lower()
-                                    for ing in recipe.ingredients])
-        for category, keywords in dish_categories.items():
-            for keyword in keywords:
-                if keyword in ingredients_text:
-                    return category
-        return "unknown"
-
-    dish_type1 = get_dish_type(recipe1)
-    dish_type2 = get_dish_type(recipe2)
-
     if dish_type1 == dish_type2 and dish_type1 != "unknown":
         similarity_score += weight
         total_weight += weight
 
     # 4. Attributi dietetici (peso: 0.15)
     weight = 0.15
-    dietary_attrs1 = (recipe1.is_vegan, recipe1.is_vegetarian,
-                      recipe1.is_gluten_free, recipe1.is_lactose_free)
-    dietary_attrs2 = (recipe2.is_vegan, recipe2.is_vegetarian,
-                      recipe2.is_gluten_free, recipe2.is_lactose_free)
-
     dietary_similarity = sum(a == b for a, b in zip(
         dietary_attrs1, dietary_attrs2)) / 4.0
     similarity_score += dietary_similarity * weight
@@ -705,6 +700,31 @@ def calculate_recipe_similarity(recipe1: FinalRecipeOption, recipe2: FinalRecipe
     return similarity_score / total_weight if total_weight > 0 else 0.0
 
 
+def calculate_recipe_similarity(recipe1: FinalRecipeOption, recipe2: FinalRecipeOption) -> float:
+    """
+    Calcola un punteggio di somiglianza tra due ricette basato su vari fattori.
+
+    Criteri di similarità (con pesi differenti):
+    1. Somiglianza nel titolo (peso: 0.2) - escluse parole comuni
+    2. Ingredienti principali condivisi (peso: 0.4) - top 3 per quantità
+    3. Tipo di piatto basato su parole chiave (peso: 0.25)
+    4. Attributi dietetici comuni (peso: 0.15) - vegano, vegetariano, ecc.
+
+    Args:
+        recipe1, recipe2: Le ricette da confrontare
+
+    Returns:
+        Punteggio da 0.0 (completamente diverse) a 1.0 (identiche)
+    """
+    return _similarity_from_features(_recipe_similarity_features(recipe1),
+                                     _recipe_similarity_features(recipe2))
+
+
+def _canonical_recipe_name(name: str) -> str:
+    """Chiave canonica del nome ricetta: minuscolo e spazi compattati."""
+    return " ".join(name.lower().split())
+
+
 def ensure_recipe_diversity(recipes: List[FinalRecipeOption], target_cho: float, similarity_threshold: float = 0.6) -> List[FinalRecipeOption]:
     """
     Filtra una lista di ricette per assicurarsi che non ci siano ricette troppo simili tra loro.
@@ -728,27 +748,55 @@ def ensure_recipe_diversity(recipes: List[FinalRecipeOption], target_cho: float,
     sorted_recipes = sorted(recipes, key=lambda r: abs(
         r.total_cho - target_cho) if r.total_cho else float('inf'))
 
+    # Caratteristiche di similarità estratte una volta per ricetta, non per coppia
+    features = [_recipe_similarity_features(r) for r in sorted_recipes]
+
     # Lista per le ricette diverse
     diverse_recipes = [sorted_recipes[0]]  # Inizia con la migliore ricetta
+    diverse_features = [features[0]]
+    # Nomi canonici (minuscolo, spazi compattati) già selezionati: i doppioni
+    # esatti si scartano con un lookup O(1), senza confronto a coppie
+    selected_names = {_canonical_recipe_name(sorted_recipes[0].name)}
 
     # Controlla le ricette rimanenti
-    for candidate in sorted_recipes[1:]:
+    for candidate, candidate_features in zip(sorted_recipes[1:], features[1:]):
+        name_key = _canonical_recipe_name(candidate.name)
+        if name_key in selected_names:
+            _log.info(
+                "Ricetta '%s' scartata: nome già presente tra le ricette selezionate", candidate.name)
+            continue
+
         # Calcola similarità con tutte le ricette già selezionate
         is_too_similar = False
-        for selected in diverse_recipes:
-            similarity = calculate_recipe_similarity(candidate, selected)
+        for selected, selected_features in zip(diverse_recipes, diverse_features):
+            similarity = _similarity_from_features(
+                candidate_features, selected_features)
             if similarity > similarity_threshold:
                 is_too_similar = True
-                print(
-                    f"Ricetta '{candidate.name}' scartata: troppo simile a '{selected.name}' (similarità: {similarity:.2f})")
+                _log.info(
+                    "Ricetta '%s' scartata: troppo simile a '%s' (similarità: %.2f)", candidate.name, selected.name, similarity)
                 break
 
         if not is_too_similar:
             diverse_recipes.append(candidate)
+            diverse_features.append(candidate_features)
+            selected_names.add(name_key)
 
     return diverse_recipes
 
 
+# Similarità minima (difflib ratio) per accettare una correzione fuzzy del nome
+FUZZY_MATCH_CUTOFF = 0.85
+
+
+def build_lowercase_mapping(ingredient_data: Dict[str, IngredientInfo]) -> Dict[str, str]:
+    """Mappa nome minuscolo -> nome originale nel DB (vince la prima occorrenza)."""
+    lowercase_to_original = {}
+    for db_ingredient in ingredient_data:
+        lowercase_to_original.setdefault(db_ingredient.lower(), db_ingredient)
+    return lowercase_to_original
+
+
 def match_recipe_ingredients(recipe: FinalRecipeOption,
                              ingredient_data: Dict[str, IngredientInfo],
                              normalized_to_original: Dict[str, str],
@@ -756,24 +804,28 @@ def match_recipe_ingredients(recipe: FinalRecipeOption,
                              faiss_index,
                              index_to_name_mapping,
                              embedding_model,
-                             normalize_function) -> Tuple[FinalRecipeOption, bool]:
+                             normalize_function,
+                             lowercase_to_original: Optional[Dict[str, str]] = None) -> Tuple[FinalRecipeOption, bool]:
     """
     Effettua il matching degli ingredienti della ricetta con il database usando FAISS.
     Utilizza mappature normalizzate per un matching coerente.
+    La mappa minuscolo -> nome DB può essere calcolata una volta dal chiamante
+    e condivisa tra tutte le ricette.
     """
+    if lowercase_to_original is None:
+        lowercase_to_original = build_lowercase_mapping(ingredient_data)
+
     matched_recipe = deepcopy(recipe)
     matched_ingredients = []
     all_matched = True
 
-    print(f"Matching ingredienti per ricetta '{recipe.name}'")
+    _log.debug("Matching ingredienti per ricetta '%s'", recipe.name)
 
     # DEBUG - Verifica la presenza dei dati nel database
-    print(
-        f"DEBUG: Database ingredienti contiene {len(ingredient_data)} elementi")
-    print(
-        f"DEBUG: Mapping normalizzato contiene {len(normalized_to_original)} elementi")
-    sample_keys = list(ingredient_data.keys())[:5]
-    print(f"DEBUG: Primi 5 ingredienti nel DB: {sample_keys}")
+    _log.debug("Database ingredienti contiene %d elementi", len(ingredient_data))
+    _log.debug("Mapping normalizzato contiene %d elementi", len(normalized_to_original))
+    sample_keys = list(islice(ingredient_data, 5))
+    _log.debug("Primi 5 ingredienti nel DB: %s", sample_keys)
 
     for ing in recipe.ingredients:
         # Tenta il matching con FAISS
@@ -788,20 +840,21 @@ def match_recipe_ingredients(recipe: FinalRecipeOption,
 
         ingredient_matched = False
 
+        # Nomi dal DB e quantità dalla ricetta già validata: gli ingredienti
+        # si costruiscono con model_construct, senza rivalidare
         if match_result:
             matched_db_name, match_score = match_result
-            print(
-                f"Ingrediente '{ing.name}' matchato a '{matched_db_name}' (score: {match_score:.2f})")
+            _log.debug(
+                "Ingrediente '%s' matchato a '%s' (score: %.2f)", ing.name, matched_db_name, match_score)
 
             # SEQUENZA DI TENTATIVI DI MATCH
 
             # 1. Prova con il nome esatto restituito dal matching
             if matched_db_name in ingredient_data:
-                print(
-                    f"Trovato direttamente con nome matchato: '{matched_db_name}'")
+                _log.debug("Trovato direttamente con nome matchato: '%s'", matched_db_name)
                 matched_ingredients.append(
-                    RecipeIngredient(name=matched_db_name,
-                                     quantity_g=ing.quantity_g)
+                    RecipeIngredient.model_construct(
+                        name=matched_db_name, quantity_g=ing.quantity_g)
                 )
                 ingredient_matched = True
                 continue
@@ -810,32 +863,26 @@ def match_recipe_ingredients(recipe: FinalRecipeOption,
             normalized_name = normalize_function(matched_db_name)
             if normalized_name in normalized_to_original:
                 original_db_name = normalized_to_original[normalized_name]
-                print(
-                    f"Usando mappatura normalizzata: '{matched_db_name}' -> '{original_db_name}'")
+                _log.debug(
+                    "Usando mappatura normalizzata: '%s' -> '%s'", matched_db_name, original_db_name)
 
                 if original_db_name in ingredient_data:
                     matched_ingredients.append(
-                        RecipeIngredient(name=original_db_name,
-                                         quantity_g=ing.quantity_g)
+                        RecipeIngredient.model_construct(
+                            name=original_db_name, quantity_g=ing.quantity_g)
                     )
                     ingredient_matched = True
                     continue
 
             # 3. Tenta una ricerca case-insensitive nel database
-            found = False
-            for db_ingredient in ingredient_data.keys():
-                if matched_db_name.lower() == db_ingredient.lower():
-                    print(
-                        f"Match case-insensitive: '{matched_db_name}' -> '{db_ingredient}'")
-                    matched_ingredients.append(
-                        RecipeIngredient(name=db_ingredient,
-                                         quantity_g=ing.quantity_g)
-                    )
-                    found = True
-                    ingredient_matched = True
-                    break
-
-            if found:
+            db_ingredient = lowercase_to_original.get(matched_db_name.lower())
+            if db_ingredient is not None:
+                _log.debug("Match case-insensitive: '%s' -> '%s'", matched_db_name, db_ingredient)
+                matched_ingredients.append(
+                    RecipeIngredient.model_construct(
+                        name=db_ingredient, quantity_g=ing.quantity_g)
+                )
+                ingredient_matched = True
                 continue
 
             # 4. Prova fallback per ingredienti problematici
@@ -843,20 +890,19 @@ def match_recipe_ingredients(recipe: FinalRecipeOption,
             if normalized_matched in FALLBACK_MAPPING:
                 fallback_name = FALLBACK_MAPPING[normalized_matched]
                 if fallback_name in ingredient_data:
-                    print(
-                        f"Usando fallback: '{matched_db_name}' -> '{fallback_name}'")
+                    _log.debug("Usando fallback: '%s' -> '%s'", matched_db_name, fallback_name)
                     matched_ingredients.append(
-                        RecipeIngredient(name=fallback_name,
-                                         quantity_g=ing.quantity_g)
+                        RecipeIngredient.model_construct(
+                            name=fallback_name, quantity_g=ing.quantity_g)
                     )
                     ingredient_matched = True
                     continue
 
             # 5. Se ancora non trovato, prova a cercare con il nome originale dell'LLM
             if ing.name in ingredient_data:
-                print(f"Usando nome LLM originale: '{ing.name}'")
+                _log.debug("Usando nome LLM originale: '%s'", ing.name)
                 matched_ingredients.append(
-                    RecipeIngredient(name=ing.name, quantity_g=ing.quantity_g)
+                    RecipeIngredient.model_construct(name=ing.name, quantity_g=ing.quantity_g)
                 )
                 ingredient_matched = True
                 continue
@@ -866,38 +912,59 @@ def match_recipe_ingredients(recipe: FinalRecipeOption,
             if normalized_original in FALLBACK_MAPPING:
                 fallback_name = FALLBACK_MAPPING[normalized_original]
                 if fallback_name in ingredient_data:
-                    print(
-                        f"Usando fallback da originale: '{ing.name}' -> '{fallback_name}'")
+                    _log.debug(
+                        "Usando fallback da originale: '%s' -> '%s'", ing.name, fallback_name)
                     matched_ingredients.append(
-                        RecipeIngredient(name=fallback_name,
-                                         quantity_g=ing.quantity_g)
+                        RecipeIngredient.model_construct(
+                            name=fallback_name, quantity_g=ing.quantity_g)
                     )
                     ingredient_matched = True
                     continue
         else:
-            print(f"Nessun match trovato per '{ing.name}'")
+            _log.debug("Nessun match trovato per '%s'", ing.name)
 
             # Prova fallback per ingredienti non matchati
             normalized_original = normalize_function(ing.name)
             if normalized_original in FALLBACK_MAPPING:
                 fallback_name = FALLBACK_MAPPING[normalized_original]
                 if fallback_name in ingredient_data:
-                    print(
-                        f"Usando fallback per non matchato: '{ing.name}' -> '{fallback_name}'")
+                    _log.debug(
+                        "Usando fallback per non matchato: '%s' -> '%s'", ing.name, fallback_name)
                     matched_ingredients.append(
-                        RecipeIngredient(name=fallback_name,
-                                         quantity_g=ing.quantity_g)
+                        RecipeIngredient.model_construct(
+                            name=fallback_name, quantity_g=ing.quantity_g)
                     )
                     ingredient_matched = True
                     continue
 
+        # Ultimo tentativo locale: correzione fuzzy del nome (es. refusi dell'LLM)
+        # prima di scartare l'ingrediente e con esso l'intera ricetta
+        # (i candidati incompatibili, es. 'pepe nero' -> 'peperone', vengono scartati)
+        if not ingredient_matched:
+            close_matches = get_close_matches(
+                ing.name.lower(), lowercase_to_original, n=3, cutoff=FUZZY_MATCH_CUTOFF)
+            fuzzy_name = next(
+                (lowercase_to_original[candidate] for candidate in close_matches
+                 if not is_incompatible_match(ing.name, lowercase_to_original[candidate])),
+                None)
+            if fuzzy_name is not None:
+                _log.info("Correzione fuzzy: '%s' -> '%s'", ing.name, fuzzy_name)
+                matched_ingredients.append(
+                    RecipeIngredient.model_construct(
+                        name=fuzzy_name, quantity_g=ing.quantity_g)
+                )
+                continue
+            if close_matches:
+                _log.info(
+                    "Correzione fuzzy incompatibile ignorata per '%s': %s", ing.name, close_matches)
+
         # Se arriviamo qui, nessuno dei tentativi ha avuto successo
         if not ingredient_matched:
             all_matched = False
-            print(
-                f"ERRORE: '{matched_db_name if match_result else ing.name}' non trovato nel database degli ingredienti!")
+            _log.warning(
+                "ERRORE: '%s' non trovato nel database degli ingredienti!", matched_db_name if match_result else ing.name)
             matched_ingredients.append(
-                RecipeIngredient(
+                RecipeIngredient.model_construct(
                     name=f"{ing.name} (Info Mancanti!)", quantity_g=ing.quantity_g)
             )
 
@@ -911,20 +978,70 @@ def match_recipe_ingredients(recipe: FinalRecipeOption,
 
     # Calcola totali solo se tutti gli ingredienti sono stati matchati
     if all_matched:
-        matched_recipe.total_cho = sum(
-            ing.cho_contribution for ing in calculated_ingredients if ing.cho_contribution is not None)
-        matched_recipe.total_calories = sum(
-            ing.calories_contribution for ing in calculated_ingredients if ing.calories_contribution is not None)
-        matched_recipe.total_protein_g = sum(
-            ing.protein_contribution_g for ing in calculated_ingredients if ing.protein_contribution_g is not None)
-        matched_recipe.total_fat_g = sum(
-            ing.fat_contribution_g for ing in calculated_ingredients if ing.fat_contribution_g is not None)
-        matched_recipe.total_fiber_g = sum(
-            ing.fiber_contribution_g for ing in calculated_ingredients if ing.fiber_contribution_g is not None)
+        (matched_recipe.total_cho, matched_recipe.total_calories,
+         matched_recipe.total_protein_g, matched_recipe.total_fat_g,
+         matched_recipe.total_fiber_g) = _nutrition_totals(calculated_ingredients)
 
     return matched_recipe, all_matched
 
 
+# Parole chiave di ingredienti incompatibili con ciascuna dieta (controllo sui nomi)
+NON_VEGAN_KEYWORDS = frozenset({
+    "pollo", "tacchino", "manzo", "vitello", "maiale", "prosciutto",
+    "pancetta", "salmone", "tonno", "pesce", "uova", "uovo", "formaggio",
+    "parmigiano", "mozzarella", "ricotta", "burro", "latte", "panna"
+})
+NON_VEGETARIAN_KEYWORDS = frozenset({
+    "pollo", "tacchino", "manzo", "vitello", "maiale", "prosciutto",
+    "pancetta", "salmone", "tonno", "pesce"
+})
+GLUTEN_KEYWORDS = frozenset({
+    "pasta", "pane", "farina", "couscous", "orzo", "farro",
+    "seitan", "pangrattato", "grano"
+})
+LACTOSE_KEYWORDS = frozenset({
+    "latte", "formaggio", "parmigiano", "mozzarella", "ricotta",
+    "burro", "panna", "yogurt"
+})
+
+# Bit dei flag dietetici: vegano, vegetariano, senza glutine, senza lattosio
+DIET_VEGAN = 1
+DIET_VEGETARIAN = 2
+DIET_GLUTEN_FREE = 4
+DIET_LACTOSE_FREE = 8
+_ALL_DIET_FLAGS = DIET_VEGAN | DIET_VEGETARIAN | DIET_GLUTEN_FREE | DIET_LACTOSE_FREE
+
+
+def _dietary_mask(is_vegan: bool, is_vegetarian: bool,
+                  is_gluten_free: bool, is_lactose_free: bool) -> int:
+    """Impacchetta i quattro flag dietetici in una bitmask."""
+    return ((DIET_VEGAN if is_vegan else 0)
+            | (DIET_VEGETARIAN if is_vegetarian else 0)
+            | (DIET_GLUTEN_FREE if is_gluten_free else 0)
+            | (DIET_LACTOSE_FREE if is_lactose_free else 0))
+
+
+# Cache a slot singolo: (ingredient_data, n_voci, {nome: bitmask flag dietetici})
+_dietary_mask_cache = None
+
+
+def _get_dietary_masks(ingredient_data: Dict[str, IngredientInfo]) -> Dict[str, int]:
+    """
+    Bitmask dei flag dietetici per ogni ingrediente del DB, calcolate una sola
+    volta per dizionario: l'analisi di una ricetta si riduce a un AND per ingrediente.
+    """
+    global _dietary_mask_cache
+    cached = _dietary_mask_cache
+    if cached is not None and cached[0] is ingredient_data and cached[1] == len(ingredient_data):
+        return cached[2]
+
+    masks = {name: _dietary_mask(info.is_vegan, info.is_vegetarian,
+                                 info.is_gluten_free, info.is_lactose_free)
+             for name, info in ingredient_data.items()}
+    _dietary_mask_cache = (ingredient_data, len(ingredient_data), masks)
+    return masks
+
+
 def analyze_recipe_dietary_properties(
     recipe: FinalRecipeOption,
     ingredient_data: Dict[str, IngredientInfo] = None
@@ -945,85 +1062,36 @@ def analyze_recipe_dietary_properties(
     Returns:
         Tupla con 4 booleani (is_vegan, is_vegetarian, is_gluten_free, is_lactose_free)
     """
-    # Inizializza tutti i flag a True (cambieranno a False se troviamo ingredienti incompatibili)
-    is_vegan = True
-    is_vegetarian = True
-    is_gluten_free = True
-    is_lactose_free = True
-
-    # Lista di ingredienti NON vegani
-    non_vegan_ingredients = {
-        "pollo", "tacchino", "manzo", "vitello", "maiale", "prosciutto",
-        "pancetta", "salmone", "tonno", "pesce", "uova", "uovo", "formaggio",
-        "parmigiano", "mozzarella", "ricotta", "burro", "latte", "panna"
-    }
-
-    # Lista di ingredienti NON vegetariani
-    non_vegetarian_ingredients = {
-        "pollo", "tacchino", "manzo", "vitello", "maiale", "prosciutto",
-        "pancetta", "salmone", "tonno", "pesce"
-    }
-
-    # Lista di ingredienti NON senza glutine
-    gluten_ingredients = {
-        "pasta", "pane", "farina", "couscous", "orzo", "farro",
-        "seitan", "pangrattato", "grano"
-    }
-
-    # Lista di ingredienti NON senza lattosio
-    lactose_ingredients = {
-        "latte", "formaggio", "parmigiano", "mozzarella", "ricotta",
-        "burro", "panna", "yogurt"
-    }
+    # Tutti i flag partono a True (bit a 0 se troviamo ingredienti incompatibili)
+    diet_mask = _ALL_DIET_FLAGS
 
     # Se abbiamo i dati degli ingredienti, usiamo quelli
     if ingredient_data:
-        # Verifica basata sui dati degli ingredienti dal database
+        # Verifica basata sui dati degli ingredienti dal database: AND delle bitmask
+        dietary_masks = _get_dietary_masks(ingredient_data)
         for ing in recipe.ingredients:
-            if ing.name in ingredient_data:
-                info = ingredient_data[ing.name]
-                if not info.is_vegan:
-                    is_vegan = False
-                if not info.is_vegetarian:
-                    is_vegetarian = False
-                if not info.is_gluten_free:
-                    is_gluten_free = False
-                if not info.is_lactose_free:
-                    is_lactose_free = False
+            ingredient_mask = dietary_masks.get(ing.name)
+            if ingredient_mask is not None:
+                diet_mask &= ingredient_mask
+
+    is_vegan = bool(diet_mask & DIET_VEGAN)
+    is_vegetarian = bool(diet_mask & DIET_VEGETARIAN)
+    is_gluten_free = bool(diet_mask & DIET_GLUTEN_FREE)
+    is_lactose_free = bool(diet_mask & DIET_LACTOSE_FREE)
 
     # In ogni caso, fai anche un controllo basato sui nomi (per maggiore sicurezza)
     # Questo è particolarmente utile per ingredienti che potrebbero non essere nel DB
-    ing_names_lower = [ing.name.lower() for ing in recipe.ingredients]
-    combined_text = " ".join(ing_names_lower).lower()
-
-    # Controlli diretti sui nomi degli ingredienti
-    for item in non_vegan_ingredients:
-        if item in combined_text:
-            is_vegan = False
-            break
-
-    for item in non_vegetarian_ingredients:
-        if item in combined_text:
-            is_vegetarian = False
-            break
-
-    for item in gluten_ingredients:
-        if item in combined_text:
-            is_gluten_free = False
-            break
-
-    for item in lactose_ingredients:
-        if item in combined_text:
-            is_lactose_free = False
-            break
-
-    # La regola principale: se un piatto non è vegano, non può essere vegetariano
-    if not is_vegan and is_vegetarian:
-        # Verifica più attentamente se è davvero vegetariano
-        for ing in non_vegetarian_ingredients:
-            if ing in combined_text:
-                is_vegetarian = False
-                break
+    combined_text = " ".join(ing.name for ing in recipe.ingredients).lower()
+
+    # Controlli diretti sui nomi degli ingredienti (parole chiave precalcolate)
+    if is_vegan and any(item in combined_text for item in NON_VEGAN_KEYWORDS):
+        is_vegan = False
+    if is_vegetarian and any(item in combined_text for item in NON_VEGETARIAN_KEYWORDS):
+        is_vegetarian = False
+    if is_gluten_free and any(item in combined_text for item in GLUTEN_KEYWORDS):
+        is_gluten_free = False
+    if is_lactose_free and any(item in combined_text for item in LACTOSE_KEYWORDS):
+        is_lactose_free = False
 
     return is_vegan, is_vegetarian, is_gluten_free, is_lactose_free
 
@@ -1041,15 +1109,11 @@ def check_dietary_compatibility(recipe: FinalRecipeOption, preferences: UserPref
     Returns:
         True se la ricetta soddisfa le preferenze, False altrimenti
     """
-    if preferences.vegan and not recipe.is_vegan:
-        return False
-    if preferences.vegetarian and not recipe.is_vegetarian:
-        return False
-    if preferences.gluten_free and not recipe.is_gluten_free:
-        return False
-    if preferences.lactose_free and not recipe.is_lactose_free:
-        return False
-    return True
+    required = _dietary_mask(preferences.vegan, preferences.vegetarian,
+                             preferences.gluten_free, preferences.lactose_free)
+    recipe_mask = _dietary_mask(recipe.is_vegan, recipe.is_vegetarian,
+                                recipe.is_gluten_free, recipe.is_lactose_free)
+    return (recipe_mask & required) == required
 
 
 def update_recipe_dietary_flags(
@@ -1114,6 +1178,33 @@ def add_ingredient(recipe: FinalRecipeOption, new_ingredient_name: str,
     return update_recipe_dietary_flags(modified_recipe, ingredient_data)
 
 
+# Cache a slot singolo: (ingredient_data, n_voci, {flag dietetici: [(nome, info)]})
+_high_cho_cache = None
+
+
+def _get_high_cho_by_flags(ingredient_data: Dict[str, IngredientInfo]) -> Dict[Tuple[bool, bool, bool, bool], List[Tuple[str, IngredientInfo]]]:
+    """
+    Raggruppa una sola volta gli ingredienti ricchi di CHO (>20g/100g) per
+    combinazione di flag dietetici (vegano, vegetariano, senza glutine, senza lattosio).
+    Il DB è lo stesso per tutte le ricette, quindi il raggruppamento viene
+    ricalcolato solo se cambia il dizionario. L'ordine del DB è preservato.
+    """
+    global _high_cho_cache
+    cached = _high_cho_cache
+    if cached is not None and cached[0] is ingredient_data and cached[1] == len(ingredient_data):
+        return cached[2]
+
+    groups = {}
+    for name, info in ingredient_data.items():
+        if info.cho_per_100g is not None and info.cho_per_100g > 20:
+            key = (info.is_vegan, info.is_vegetarian,
+                   info.is_gluten_free, info.is_lactose_free)
+            groups.setdefault(key, []).append((name, info))
+
+    _high_cho_cache = (ingredient_data, len(ingredient_data), groups)
+    return groups
+
+
 def suggest_cho_adjustment(recipe: FinalRecipeOption, target_cho: float,
                            ingredient_data: Dict[str, IngredientInfo]) -> Optional[Tuple[str, str, float]]:
     """
@@ -1149,17 +1240,15 @@ def suggest_cho_adjustment(recipe: FinalRecipeOption, target_cho: float,
     # Determina se aumentare o ridurre CHO
     if cho_difference > 0:
         # Dobbiamo aumentare CHO
-        # Filtra ingredienti DB ricchi di CHO
-        high_cho_ingredients = [(name, info) for name, info in ingredient_data.items()
-                                if info.cho_per_100g > 20 and info.is_vegan == recipe.is_vegan
-                                and info.is_vegetarian == recipe.is_vegetarian
-                                and info.is_gluten_free == recipe.is_gluten_free
-                                and info.is_lactose_free == recipe.is_lactose_free]
+        # Ingredienti DB ricchi di CHO con gli stessi flag dietetici della ricetta
+        high_cho_ingredients = _get_high_cho_by_flags(ingredient_data).get(
+            (recipe.is_vegan, recipe.is_vegetarian, recipe.is_gluten_free, recipe.is_lactose_free), [])
 
         if high_cho_ingredients:
             # Seleziona casualmente un ingrediente
-            random.seed(42)  # Per riproducibilità
-            chosen_name, chosen_info = random.choice(high_cho_ingredients)
+            # RNG locale con seed fisso: riproducibile senza toccare lo stato globale
+            rng = random.Random(42)
+            chosen_name, chosen_info = rng.choice(high_cho_ingredients)
 
             # Calcola quantità necessaria per aggiungere CHO mancanti
             qty_needed = (cho_difference / chosen_info.cho_per_100g) * 100
@@ -1204,7 +1293,7 @@ def verifier_agent(state: GraphState) -> GraphState:
     Node Function: Verifica, ottimizza e corregge le ricette generate.
     Versione potenziata con verifica di diversità e correzione flag dietetici.
     """
-    print("\n--- ESECUZIONE NODO: Verifica e Ottimizzazione Ricette ---")
+    _log.info("--- ESECUZIONE NODO: Verifica e Ottimizzazione Ricette ---")
 
     # Recupera componenti necessari dallo stato
     recipes_from_generator = state.get('generated_recipes', [])
@@ -1220,22 +1309,20 @@ def verifier_agent(state: GraphState) -> GraphState:
     normalize_function = state.get('normalize_function')
 
     # Aggiunta di debug per ispezionare il database ingredienti
-    print(
-        f"DEBUG: Database ingredienti contiene {len(ingredient_data)} elementi")
-    print(
-        f"DEBUG: Mapping normalizzato contiene {len(normalized_to_original)} elementi")
-    print(
-        f"DEBUG: Mapping inverso contiene {len(original_to_normalized)} elementi")
+    _log.debug("Database ingredienti contiene %d elementi", len(ingredient_data))
+    _log.debug("Mapping normalizzato contiene %d elementi", len(normalized_to_original))
+    _log.debug("Mapping inverso contiene %d elementi", len(original_to_normalized))
 
     # Validazione input essenziali
     if not recipes_from_generator:
-        print("Errore Verifier: Nessuna ricetta ricevuta dal generatore.")
+        _log.error("Errore Verifier: Nessuna ricetta ricevuta dal generatore.")
         state['error_message'] = "Nessuna ricetta generata da verificare."
         state['final_verified_recipes'] = []
         return state
 
     if not all([preferences, ingredient_data, faiss_index, index_to_name_mapping, embedding_model, normalize_function]):
-        print("Errore Verifier: Componenti essenziali mancanti nello stato (prefs, db, faiss, model, etc.).")
+        _log.error(
+            "Errore Verifier: Componenti essenziali mancanti nello stato (prefs, db, faiss, model, etc.).")
         state['error_message'] = "Errore interno: Dati o componenti mancanti per la verifica."
         state['final_verified_recipes'] = []
         return state
@@ -1247,14 +1334,17 @@ def verifier_agent(state: GraphState) -> GraphState:
     min_cho_initial = target_cho - fixed_cho_tolerance
     max_cho_initial = target_cho + fixed_cho_tolerance
 
-    print(
-        f"Verifica di {len(recipes_from_generator)} ricette generate. Target CHO: {target_cho:.1f}g")
-    print(
-        f"Range CHO post-ottimizzazione iniziale target: {min_cho_initial:.1f} - {max_cho_initial:.1f}g")
+    _log.info(
+        "Verifica di %d ricette generate. Target CHO: %.1fg", len(recipes_from_generator), target_cho)
+    _log.info(
+        "Range CHO post-ottimizzazione iniziale target: %.1f - %.1fg", min_cho_initial, max_cho_initial)
 
     # --- FASE 1: MATCHING, CALCOLO NUTRIENTI E VERIFICA DIETETICA PRELIMINARE ---
     processed_recipes_phase1 = []
-    print("\nFase 1: Matching Ingredienti, Calcolo Nutrienti e Verifica Dietetica Preliminare")
+    _log.info("Fase 1: Matching Ingredienti, Calcolo Nutrienti e Verifica Dietetica Preliminare")
+
+    # Mappa case-insensitive costruita una volta e condivisa da tutte le ricette
+    lowercase_to_original = build_lowercase_mapping(ingredient_data)
 
     for recipe_gen in recipes_from_generator:
         # 1. Match ingredienti e calcolo iniziale nutrienti
@@ -1266,12 +1356,13 @@ def verifier_agent(state: GraphState) -> GraphState:
             faiss_index,
             index_to_name_mapping,
             embedding_model,
-            normalize_function
+            normalize_function,
+            lowercase_to_original
         )
 
         if not match_success:
-            print(
-                f"Ricetta '{recipe_gen.name}' scartata (Fase 1): Matching fallito o CHO non calcolabile.")
+            _log.info(
+                "Ricetta '%s' scartata (Fase 1): Matching fallito o CHO non calcolabile.", recipe_gen.name)
             continue
 
         # 2. Calcola/Verifica flag dietetici basati sul DB
@@ -1280,31 +1371,29 @@ def verifier_agent(state: GraphState) -> GraphState:
 
         # 3. Verifica preliminare rispetto alle preferenze utente
         if not check_dietary_compatibility(recipe_flags_computed, preferences):
-            print(
-                f"Ricetta '{recipe_flags_computed.name}' scartata (Fase 1): Non rispetta le preferenze dietetiche.")
+            _log.info(
+                "Ricetta '%s' scartata (Fase 1): Non rispetta le preferenze dietetiche.", recipe_flags_computed.name)
             continue
 
         # Se passa tutti i controlli della fase 1, aggiungila alla lista
         processed_recipes_phase1.append(recipe_flags_computed)
 
     if not processed_recipes_phase1:
-        print(
-            "Errore Verifier: Nessuna ricetta ha superato la Fase 1 (matching/dietetica).")
+        _log.error("Errore Verifier: Nessuna ricetta ha superato la Fase 1 (matching/dietetica).")
         state['error_message'] = "Nessuna ricetta valida dopo il matching iniziale e la verifica dietetica."
         state['final_verified_recipes'] = []
         return state
-    print(
-        f"Ricette che hanno superato la Fase 1: {len(processed_recipes_phase1)}")
+    _log.info("Ricette che hanno superato la Fase 1: %d", len(processed_recipes_phase1))
 
     # --- FASE 2: OTTIMIZZAZIONE CHO ---
     processed_recipes_phase2 = []
-    print("\nFase 2: Ottimizzazione CHO")
+    _log.info("Fase 2: Ottimizzazione CHO")
 
     for recipe_p1 in processed_recipes_phase1:
         # Controlla se CHO è valido prima di ottimizzare
         if recipe_p1.total_cho is None:
-            print(
-                f"Ricetta '{recipe_p1.name}' scartata (Fase 2): CHO non calcolato, impossibile ottimizzare.")
+            _log.info(
+                "Ricetta '%s' scartata (Fase 2): CHO non calcolato, impossibile ottimizzare.", recipe_p1.name)
             continue
 
         # Verifica se è già nel range target INIZIALE
@@ -1312,15 +1401,15 @@ def verifier_agent(state: GraphState) -> GraphState:
             min_cho_initial <= recipe_p1.total_cho <= max_cho_initial)
 
         if is_in_initial_range:
-            print(
-                f"Ricetta '{recipe_p1.name}' già nel range CHO iniziale ({recipe_p1.total_cho:.1f}g).")
+            _log.info(
+                "Ricetta '%s' già nel range CHO iniziale (%.1fg).", recipe_p1.name, recipe_p1.total_cho)
             # Mantiene la ricetta così com'è
             processed_recipes_phase2.append(recipe_p1)
             continue
 
         # Se non è nel range, tenta l'ottimizzazione
-        print(
-            f"Ricetta '{recipe_p1.name}' fuori range iniziale ({recipe_p1.total_cho:.1f}g). Tento ottimizzazione...")
+        _log.info(
+            "Ricetta '%s' fuori range iniziale (%.1fg). Tento ottimizzazione...", recipe_p1.name, recipe_p1.total_cho)
         optimized_recipe = optimize_recipe_cho(
             deepcopy(recipe_p1), target_cho, ingredient_data)
 
@@ -1330,19 +1419,19 @@ def verifier_agent(state: GraphState) -> GraphState:
             improved = abs(optimized_recipe.total_cho -
                            target_cho) < abs(recipe_p1.total_cho - target_cho)
             if is_optimized_in_range:
-                print(
-                    f" -> Ottimizzazione riuscita! Nuovo CHO: {optimized_recipe.total_cho:.1f}g (Nel range iniziale)")
+                _log.info(
+                    " -> Ottimizzazione riuscita! Nuovo CHO: %.1fg (Nel range iniziale)", optimized_recipe.total_cho)
                 processed_recipes_phase2.append(optimized_recipe)
             elif improved:
-                print(
-                    f" -> Ottimizzazione parziale. Nuovo CHO: {optimized_recipe.total_cho:.1f}g (Migliorato ma fuori range iniziale)")
+                _log.info(
+                    " -> Ottimizzazione parziale. Nuovo CHO: %.1fg (Migliorato ma fuori range iniziale)", optimized_recipe.total_cho)
                 processed_recipes_phase2.append(optimized_recipe)
             else:
-                print(
-                    f" -> Ottimizzazione non migliorativa (Nuovo CHO: {optimized_recipe.total_cho:.1f}g). Scarto ricetta.")
+                _log.info(
+                    " -> Ottimizzazione non migliorativa (Nuovo CHO: %.1fg). Scarto ricetta.", optimized_recipe.total_cho)
         else:
-            print(
-                f" -> Ottimizzazione base fallita per '{recipe_p1.name}'. Tento aggiustamento ADD/MODIFY...")
+            _log.info(
+                " -> Ottimizzazione base fallita per '%s'. Tento aggiustamento ADD/MODIFY...", recipe_p1.name)
             adjustment_suggestion = suggest_cho_adjustment(
                 recipe_p1, target_cho, ingredient_data)
             adjusted_recipe = None
@@ -1365,11 +1454,11 @@ def verifier_agent(state: GraphState) -> GraphState:
                             adjusted_recipe = fine_tune_recipe(
                                 deepcopy(recipe_p1), target_ing_to_modify, cho_diff_for_tune, ingredient_data)
                         else:
-                            print(
-                                f"Errore (suggest-modify): Info CHO mancanti per '{ingredient_name_db}'")
+                            _log.warning(
+                                "Errore (suggest-modify): Info CHO mancanti per '%s'", ingredient_name_db)
                     else:
-                        print(
-                            f"Errore (suggest-modify): Ingrediente '{ingredient_name_db}' non trovato o qtà nulla in ricetta.")
+                        _log.warning(
+                            "Errore (suggest-modify): Ingrediente '%s' non trovato o qtà nulla in ricetta.", ingredient_name_db)
 
             if adjusted_recipe and adjusted_recipe.total_cho is not None:
                 is_adjusted_in_range = (
@@ -1377,39 +1466,35 @@ def verifier_agent(state: GraphState) -> GraphState:
                 improved_drastic = abs(
                     adjusted_recipe.total_cho - target_cho) < abs(recipe_p1.total_cho - target_cho)
                 if is_adjusted_in_range:
-                    print(
-                        f" -> Aggiustamento ADD/MODIFY riuscito! Nuovo CHO: {adjusted_recipe.total_cho:.1f}g (Nel range iniziale)")
+                    _log.info(
+                        " -> Aggiustamento ADD/MODIFY riuscito! Nuovo CHO: %.1fg (Nel range iniziale)", adjusted_recipe.total_cho)
                     processed_recipes_phase2.append(adjusted_recipe)
                 elif improved_drastic:
-                    print(
-                        f" -> Aggiustamento ADD/MODIFY parziale. Nuovo CHO: {adjusted_recipe.total_cho:.1f}g (Migliorato ma fuori range iniziale)")
+                    _log.info(
+                        " -> Aggiustamento ADD/MODIFY parziale. Nuovo CHO: %.1fg (Migliorato ma fuori range iniziale)", adjusted_recipe.total_cho)
                     processed_recipes_phase2.append(adjusted_recipe)
                 else:
-                    print(
-                        f" -> Aggiustamento ADD/MODIFY non migliorativo. Scarto ricetta.")
+                    _log.info(" -> Aggiustamento ADD/MODIFY non migliorativo. Scarto ricetta.")
             else:
-                print(
-                    f" -> Ottimizzazione/Aggiustamento falliti definitivamente per '{recipe_p1.name}'. Scarto ricetta.")
+                _log.info(
+                    " -> Ottimizzazione/Aggiustamento falliti definitivamente per '%s'. Scarto ricetta.", recipe_p1.name)
 
     if not processed_recipes_phase2:
-        print(
-            "Errore Verifier: Nessuna ricetta ha superato la Fase 2 (ottimizzazione CHO).")
+        _log.error("Errore Verifier: Nessuna ricetta ha superato la Fase 2 (ottimizzazione CHO).")
         state['error_message'] = "Nessuna ricetta è risultata valida o ottimizzabile per il target CHO."
         state['final_verified_recipes'] = []
         return state
-    print(
-        f"Ricette che hanno superato la Fase 2: {len(processed_recipes_phase2)}")
+    _log.info("Ricette che hanno superato la Fase 2: %d", len(processed_recipes_phase2))
 
     # --- FASE 3: VERIFICA FINALE (QUALITÀ, REALISMO, RANGE STRETTO) ---
     processed_recipes_phase3 = []  # Cambiato nome variabile per chiarezza
-    print("\nFase 3: Verifica Finale (Qualità, Realismo, Range CHO Stretto)")
+    _log.info("Fase 3: Verifica Finale (Qualità, Realismo, Range CHO Stretto)")
 
     # Tolleranza % finale più stretta
     fixed_cho_tolerance = 6.0  # +/- 15%
     min_cho_final = target_cho - fixed_cho_tolerance
     max_cho_final = target_cho + fixed_cho_tolerance
-    print(
-        f"Range CHO finale target: {min_cho_final:.1f} - {max_cho_final:.1f}g")
+    _log.info("Range CHO finale target: %.1f - %.1fg", min_cho_final, max_cho_final)
 
     # Soglia quantità massima e ingredienti da escludere
     max_ingredient_quantity_g = 250.0
@@ -1417,20 +1502,17 @@ def verifier_agent(state: GraphState) -> GraphState:
         "brodo vegetale", "acqua", "latte", "vino bianco", "brodo di pollo", "brodo di pesce",
         "passata di pomodoro", "polpa di pomodoro"
     }
-    print(
-        f"Controllo quantità massima per ingrediente solido: < {max_ingredient_quantity_g}g")
+    _log.info("Controllo quantità massima per ingrediente solido: < %sg", max_ingredient_quantity_g)
 
     # Usa la variabile corretta (processed_recipes_phase2) nel loop
     for recipe_p2 in processed_recipes_phase2:
         # a) Controllo numero minimo ingredienti
         if not recipe_p2.ingredients or len(recipe_p2.ingredients) < 3:
-            print(
-                f"Ricetta '{recipe_p2.name}' scartata (Fase 3): Meno di 3 ingredienti.")
+            _log.info("Ricetta '%s' scartata (Fase 3): Meno di 3 ingredienti.", recipe_p2.name)
             continue
         # b) Controllo numero minimo istruzioni
         if not recipe_p2.instructions or len(recipe_p2.instructions) < 2:
-            print(
-                f"Ricetta '{recipe_p2.name}' scartata (Fase 3): Meno di 2 istruzioni.")
+            _log.info("Ricetta '%s' scartata (Fase 3): Meno di 2 istruzioni.", recipe_p2.name)
             continue
 
         # c) *** INIZIO BLOCCO CONTROLLO QUANTITA' MASSIMA ***
@@ -1442,8 +1524,8 @@ def verifier_agent(state: GraphState) -> GraphState:
             if check_name and check_name not in quantity_check_exclusions:
                 # Controlla la quantità solo se è un numero valido
                 if ing.quantity_g is not None and ing.quantity_g > max_ingredient_quantity_g:
-                    print(
-                        f"Ricetta '{recipe_p2.name}' scartata (Fase 3): Ingrediente '{check_name}' supera quantità massima ({ing.quantity_g:.1f}g > {max_ingredient_quantity_g:.1f}g)")
+                    _log.info(
+                        "Ricetta '%s' scartata (Fase 3): Ingrediente '%s' supera quantità massima (%.1fg > %.1fg)", recipe_p2.name, check_name, ing.quantity_g, max_ingredient_quantity_g)
                     quantity_ok = False
                     break  # Esci dal loop interno
         if not quantity_ok:
@@ -1453,52 +1535,51 @@ def verifier_agent(state: GraphState) -> GraphState:
 
         # d) Controllo range CHO finale (stretto)
         if not (recipe_p2.total_cho and min_cho_final <= recipe_p2.total_cho <= max_cho_final):
-            print(
-                f"Ricetta '{recipe_p2.name}' scartata (Fase 3): CHO={recipe_p2.total_cho:.1f}g fuori dal range finale ({min_cho_final:.1f}-{max_cho_final:.1f}g)")
+            _log.info(
+                "Ricetta '%s' scartata (Fase 3): CHO=%.1fg fuori dal range finale (%.1f-%.1fg)", recipe_p2.name, recipe_p2.total_cho, min_cho_final, max_cho_final)
             continue
 
         # e) Ri-verifica preferenze dietetiche (sicurezza)
         if not check_dietary_compatibility(recipe_p2, preferences):
-            print(
-                f"Ricetta '{recipe_p2.name}' scartata (Fase 3): Fallita verifica dietetica finale.")
+            _log.info(
+                "Ricetta '%s' scartata (Fase 3): Fallita verifica dietetica finale.", recipe_p2.name)
             continue
 
         # Se passa tutti i controlli della fase 3
-        print(
-            f"Ricetta '{recipe_p2.name}' verificata (Fase 3) (CHO: {recipe_p2.total_cho:.1f}g, Ingredienti: {len(recipe_p2.ingredients)})")
+        _log.info(
+            "Ricetta '%s' verificata (Fase 3) (CHO: %.1fg, Ingredienti: %d)", recipe_p2.name, recipe_p2.total_cho, len(recipe_p2.ingredients))
         # Aggiungi alla lista di quelle che passano la fase 3
         processed_recipes_phase3.append(recipe_p2)
 
     if not processed_recipes_phase3:
-        print("Errore Verifier: Nessuna ricetta ha superato la Fase 3 (verifiche finali).")
+        _log.error("Errore Verifier: Nessuna ricetta ha superato la Fase 3 (verifiche finali).")
         state['error_message'] = "Nessuna ricetta ha superato i controlli finali di qualità e range CHO."
         state['final_verified_recipes'] = []
         return state
-    print(
-        f"Ricette che hanno superato la Fase 3: {len(processed_recipes_phase3)}")
+    _log.info("Ricette che hanno superato la Fase 3: %d", len(processed_recipes_phase3))
 
     # --- FASE 4: VERIFICA DIVERSITÀ ---
     processed_recipes_phase4 = []  # Cambiato nome variabile
     if len(processed_recipes_phase3) > 1:
-        print("\nFase 4: Verifica Diversità tra Ricette")
+        _log.info("Fase 4: Verifica Diversità tra Ricette")
         similarity_thr = 0.65
         # Usa la lista corretta (processed_recipes_phase3) come input
         processed_recipes_phase4 = ensure_recipe_diversity(
             processed_recipes_phase3, target_cho, similarity_threshold=similarity_thr)
-        print(
-            f"Ricette diverse selezionate: {len(processed_recipes_phase4)} su {len(processed_recipes_phase3)} (Soglia: {similarity_thr})")
+        _log.info(
+            "Ricette diverse selezionate: %d su %d (Soglia: %s)", len(processed_recipes_phase4), len(processed_recipes_phase3), similarity_thr)
     else:
         # Se c'è solo una ricetta, passa direttamente
         processed_recipes_phase4 = processed_recipes_phase3
 
     if not processed_recipes_phase4:
-        print("Errore Verifier: Nessuna ricetta rimasta dopo il controllo di diversità.")
+        _log.error("Errore Verifier: Nessuna ricetta rimasta dopo il controllo di diversità.")
         state['error_message'] = "Nessuna ricetta selezionata dopo il filtro di diversità."
         state['final_verified_recipes'] = []
         return state
 
     # --- FASE 5: SELEZIONE FINALE E ORDINAMENTO ---
-    print("\nFase 5: Selezione Finale e Ordinamento")
+    _log.info("Fase 5: Selezione Finale e Ordinamento")
     # Ordina le ricette diverse (processed_recipes_phase4) per vicinanza al target CHO
     processed_recipes_phase4.sort(key=lambda r: abs(
         r.total_cho - target_cho) if r.total_cho is not None else float('inf'))
@@ -1506,8 +1587,7 @@ def verifier_agent(state: GraphState) -> GraphState:
     # Limita al numero massimo desiderato di ricette finali
     max_final_recipes = 3  # Puoi cambiare questo valore
     final_selected_recipes = processed_recipes_phase4[:max_final_recipes]
-    print(
-        f"Selezionate le migliori {len(final_selected_recipes)} ricette finali.")
+    _log.info("Selezionate le migliori %d ricette finali.", len(final_selected_recipes))
 
     # --- AGGIORNA STATO FINALE ---
     state['final_verified_recipes'] = final_selected_recipes
@@ -1520,6 +1600,6 @@ def verifier_agent(state: GraphState) -> GraphState:
     else:
         state.pop('error_message', None)  # Rimuovi errore se successo pieno
 
-    print(
-        f"\n--- Verifica completata: {len(final_selected_recipes)} ricette finali selezionate ---")
+    _log.info(
+        "--- Verifica completata: %d ricette finali selezionate ---", len(final_selected_recipes))
     return state
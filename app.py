@@ -34,7 +34,7 @@ load_dotenv()
 try:
     from main import run_recipe_generation
     from model_schema import UserPreferences, GraphState
-    from utils import normalize_name
+    from utils import normalize_name, setup_logging
     from utils_app import get_base64_encoded_image, get_img_html, image_checkbox, \
         load_sbert_model_cached, load_faiss_index_cached, load_name_mapping_cached, \
         load_basic_ingredient_info_cached, load_ingredient_info_with_mappings_cached
@@ -44,6 +44,9 @@ except ImportError as e:
         f"Errore import: {e}. Assicurati che tutti i file .py siano presenti e corretti.")
     st.stop()
 
+# Logging tramite coda e thread di background (una sola volta per processo)
+setup_logging()
+
 # --- Definizione Costanti ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
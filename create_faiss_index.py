@@ -90,7 +90,7 @@ def prepare_consistent_ingredient_data(filepath: str) -> list[str]:
                 continue
 
             # Aggiungi singolare/plurale solo per parole non escluse
-            if name.endswith('e') and name not in ['latte', 'miele', 'olive', 'fave']:
+            if name.endswith('e') and name not in {'latte', 'miele', 'olive', 'fave'}:
                 enhanced_names.append(name[:-1] + 'i')
             elif name.endswith('a'):
                 enhanced_names.append(name[:-1] + 'e')
@@ -44,12 +44,14 @@ def convert_html_to_text(html_content):
         if not replaced:
             img.replace_with('')
 
-    # Converti HTML in testo con formattazione semplice
-    text_content = ""
+    # Converti HTML in testo con formattazione semplice: i pezzi vengono
+    # accumulati in liste e uniti una sola volta con join
+    text_parts = []
 
     # Titolo principale
     if soup.h1:
-        text_content += f"{soup.h1.text}\n{'=' * len(soup.h1.text)}\n\n"
+        title = soup.h1.text
+        text_parts.append(f"{title}\n{'=' * len(title)}\n\n")
 
     # Descrizione iniziale (paragrafi prima del primo <hr>)
     intro_paragraphs = []
@@ -61,8 +63,8 @@ def convert_html_to_text(html_content):
         current = current.find_next_sibling()
 
     if intro_paragraphs:
-        text_content += "\n".join(intro_paragraphs) + "\n\n"
-        text_content += "-" * 60 + "\n\n"
+        text_parts.append("\n".join(intro_paragraphs) + "\n\n")
+        text_parts.append("-" * 60 + "\n\n")
 
     # Processa ogni ricetta (definita tra <hr> tags)
     recipes = []
@@ -70,27 +72,10 @@ def convert_html_to_text(html_content):
 
     if hr_tags:
         for i in range(len(hr_tags)):
-            recipe_content = ""
+            recipe_parts = []
             current = hr_tags[i].find_next_sibling()
             while current and (i == len(hr_tags) - 1 or current != hr_tags[i+1]):
-                if current.name == 'h2':  # Nome ricetta
-                    recipe_content += f"{current.text}\n{'-' * len(current.text)}\n\n"
-                elif current.name == 'p':  # Descrizione
-                    recipe_content += f"{current.text}\n\n"
-                # Sezioni (nutrizione, ingredienti, ecc.)
-                elif current.name == 'h3':
-                    recipe_content += f"{current.text}:\n"
-                elif current.name == 'div' and 'Caratteristiche' in current.text:
-                    recipe_content += f"Caratteristiche: {current.text.replace('Caratteristiche:', '').strip()}\n\n"
-                # Liste non ordinate (ingredienti, nutrizione)
-                elif current.name == 'ul':
-                    for li in current.find_all('li'):
-                        recipe_content += f"* {li.text.strip()}\n"
-                    recipe_content += "\n"
-                elif current.name == 'ol':  # Liste ordinate (istruzioni)
-                    for idx, li in enumerate(current.find_all('li')):
-                        recipe_content += f"{idx+1}. {li.text.strip()}\n"
-                    recipe_content += "\n"
+                _append_element_text(recipe_parts, current)
 
                 # Interrompi se abbiamo raggiunto un hr o la fine del contenuto
                 next_sibling = current.find_next_sibling()
@@ -99,51 +84,71 @@ def convert_html_to_text(html_content):
 
                 current = next_sibling
 
+            recipe_content = "".join(recipe_parts)
             if recipe_content.strip():
                 recipes.append(recipe_content)
     else:
         # Estrazione alternativa se non ci sono tag hr
         for h2 in soup.find_all('h2'):
-            recipe_content = f"{h2.text}\n{'-' * len(h2.text)}\n\n"
+            recipe_parts = []
+            _append_element_text(recipe_parts, h2)
             current = h2.find_next_sibling()
             while current and current.name != 'h2':
-                if current.name == 'p':  # Descrizione
-                    recipe_content += f"{current.text}\n\n"
-                elif current.name == 'h3':  # Sezioni
-                    recipe_content += f"{current.text}:\n"
-                elif current.name == 'div' and 'Caratteristiche' in current.text:
-                    recipe_content += f"Caratteristiche: {current.text.replace('Caratteristiche:', '').strip()}\n\n"
-                elif current.name == 'ul':  # Liste non ordinate
-                    for li in current.find_all('li'):
-                        recipe_content += f"* {li.text.strip()}\n"
-                    recipe_content += "\n"
-                elif current.name == 'ol':  # Liste ordinate
-                    for idx, li in enumerate(current.find_all('li')):
-                        recipe_content += f"{idx+1}. {li.text.strip()}\n"
-                    recipe_content += "\n"
-
+                _append_element_text(recipe_parts, current)
                 current = current.find_next_sibling()
 
+            recipe_content = "".join(recipe_parts)
             if recipe_content.strip() and len(recipe_content) > len(h2.text) + 10:  # Evita ricette vuote
                 recipes.append(recipe_content)
 
     # Aggiungi ricette al testo finale
-    text_content += "\n\n".join(recipes)
+    text_parts.append("\n\n".join(recipes))
 
     # Aggiungi suggerimenti finali se presenti
     suggestions = soup.find('h3', string='Suggerimenti')
     if suggestions:
-        text_content += "\nSUGGERIMENTI\n" + "-" * 12 + "\n"
+        text_parts.append("\nSUGGERIMENTI\n" + "-" * 12 + "\n")
         current = suggestions.find_next_sibling()
         while current and current.name == 'p':
-            text_content += f"{current.text}\n"
+            text_parts.append(f"{current.text}\n")
             current = current.find_next_sibling()
 
     # Aggiungi footer
-    text_content += "\n\n" + "-" * 60 + "\n"
-    text_content += "Generato da NutriCHOice - La scelta intelligente per un'alimentazione su misura"
+    text_parts.append("\n\n" + "-" * 60 + "\n")
+    text_parts.append(
+        "Generato da NutriCHOice - La scelta intelligente per un'alimentazione su misura")
+
+    return "".join(text_parts)
+
 
-    return text_content
+def _append_element_text(parts, current):
+    """
+    Aggiunge a parts il testo di un elemento HTML di una ricetta.
+
+    Il testo dell'elemento (che BeautifulSoup ricalcola a ogni accesso a .text)
+    viene letto una sola volta.
+    """
+    if current.name == 'h2':  # Nome ricetta
+        text = current.text
+        parts.append(f"{text}\n{'-' * len(text)}\n\n")
+    elif current.name == 'p':  # Descrizione
+        parts.append(f"{current.text}\n\n")
+    # Sezioni (nutrizione, ingredienti, ecc.)
+    elif current.name == 'h3':
+        parts.append(f"{current.text}:\n")
+    elif current.name == 'div':
+        text = current.text
+        if 'Caratteristiche' in text:
+            parts.append(
+                f"Caratteristiche: {text.replace('Caratteristiche:', '').strip()}\n\n")
+    # Liste non ordinate (ingredienti, nutrizione)
+    elif current.name == 'ul':
+        parts.extend(f"* {li.text.strip()}\n" for li in current.find_all('li'))
+        parts.append("\n")
+    elif current.name == 'ol':  # Liste ordinate (istruzioni)
+        parts.extend(f"{idx+1}. {li.text.strip()}\n"
+                     for idx, li in enumerate(current.find_all('li')))
+        parts.append("\n")
 
 
 def get_download_link(text_content, filename="ricette_nutricho.txt"):
@@ -9,6 +9,7 @@ Contiene funzioni per:
 
 import time
 import os
+from itertools import islice
 from typing import List, Dict, Any, Callable
 import pandas as pd
 import numpy as np
@@ -16,6 +17,10 @@ import numpy as np
 from utils import normalize_name  # Assumi sia ancora in utils
 from model_schema import IngredientInfo
 
+# Valori testuali riconosciuti per i flag booleani del CSV (lookup O(1))
+TRUE_STRINGS = frozenset({'true', 'vero', '1', 'yes', 'sì', 'si'})
+FALSE_STRINGS = frozenset({'false', 'falso', '0', 'no'})
+
 
 def load_ingredient_database_with_mappings(filepath: str):
     """
@@ -37,7 +42,7 @@ def load_ingredient_database_with_mappings(filepath: str):
     print(
         f"Caricati {len(ingredient_data) if ingredient_data else 0} ingredienti dal database CSV")
     if ingredient_data:
-        sample_keys = list(ingredient_data.keys())[:5]
+        sample_keys = list(islice(ingredient_data, 5))
         print(f"Esempio primi 5 ingredienti: {sample_keys}")
 
     if not ingredient_data:
@@ -83,7 +88,7 @@ def load_ingredient_database_with_mappings(filepath: str):
 
     # DEBUG: Verifica alcune mappature create
     if len(normalized_to_original) > 0:
-        sample_keys = list(normalized_to_original.keys())[:3]
+        sample_keys = list(islice(normalized_to_original, 3))
         print(f"DEBUG: Esempio mappature normalizzate:")
         for key in sample_keys:
             print(f"  '{key}' -> '{normalized_to_original[key]}'")
@@ -92,7 +97,7 @@ def load_ingredient_database_with_mappings(filepath: str):
         print("DEBUG: normalized_to_original è vuoto!")
 
     if len(original_to_normalized) > 0:
-        sample_keys_orig = list(original_to_normalized.keys())[:3]
+        sample_keys_orig = list(islice(original_to_normalized, 3))
         print(f"DEBUG: Esempio mappature originali:")
         for key in sample_keys_orig:
             print(f"  '{key}' -> '{original_to_normalized[key]}'")
@@ -142,9 +147,9 @@ def load_basic_ingredient_info(filepath: str) -> Dict[str, IngredientInfo] | Non
             return value
         if isinstance(value, str):
             val = value.strip().lower()
-            if val in ('true', 'vero', '1', 'yes', 'sì', 'si'):
+            if val in TRUE_STRINGS:
                 return True
-            if val in ('false', 'falso', '0', 'no'):
+            if val in FALSE_STRINGS:
                 return False
         if isinstance(value, (int, float)):
             return bool(value)
@@ -284,7 +289,7 @@ def load_basic_ingredient_info(filepath: str) -> Dict[str, IngredientInfo] | Non
             f"--- Caricamento Info Base completato ({len(ingredients_data)} ingredienti) in {loading_end_time - start_time:.2f} secondi ---")
 
         # Debug - mostra alcuni esempi
-        sample_items = list(ingredients_data.items())[:3]
+        sample_items = list(islice(ingredients_data.items(), 3))
         for name, info in sample_items:
             print(
                 f"Ingrediente: {name}, CHO: {info.cho_per_100g}, Vegan: {info.is_vegan}")
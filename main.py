@@ -26,7 +26,8 @@ from sentence_transformers import SentenceTransformer
 from model_schema import UserPreferences, GraphState
 from loaders import load_basic_ingredient_info, load_ingredient_database_with_mappings
 from workflow import create_workflow  # Usa il workflow aggiornato
-from utils import normalize_name
+from agents.formatter_agent import get_final_output
+from utils import normalize_name, setup_logging
 from dotenv import load_dotenv
 import os
 
@@ -90,8 +91,8 @@ def run_recipe_generation(
         return f"Errore critico durante l'esecuzione del workflow: {wf_err}"
 
     # 4. Estrai e Restituisci l'Output Finale
-    output_string = final_state.get(
-        "final_output", "Nessun output formattato generato.")
+    output_string = get_final_output(
+        final_state, "Nessun output formattato generato.")
     error_msg = final_state.get("error_message")
 
     # Aggiungi eventuale messaggio d'errore dal workflow all'output testuale
@@ -118,6 +119,7 @@ def run_recipe_generation(
 if __name__ == "__main__":
     # Carica variabili d'ambiente (es. OPENAI_API_KEY)
     load_dotenv()
+    setup_logging()
 
     # Configurazione Argomenti Command-Line
     parser = argparse.ArgumentParser(
@@ -131,6 +133,10 @@ if __name__ == "__main__":
                         help="Solo ricette senza glutine")
     parser.add_argument("--lactose_free", action="store_true",
                         help="Solo ricette senza lattosio")
+    parser.add_argument("--batch_api", action="store_true",
+                        help="Genera le ricette tramite OpenAI Batch API (costo dimezzato, solo per uso "
+                             "offline: il completamento può richiedere ore; dopo 5 minuti "
+                             "si ripiega sulla generazione diretta)")
     args = parser.parse_args()
 
     # --- Caricamento Risorse per CLI ---
@@ -170,6 +176,7 @@ if __name__ == "__main__":
         vegetarian=args.vegetarian or args.vegan,  # Vegano implica vegetariano
         gluten_free=args.gluten_free,
         lactose_free=args.lactose_free,
+        use_batch_api=args.batch_api,
     )
 
     # --- Prepara Stato Iniziale per CLI ---
@@ -9,7 +9,7 @@ Contiene:
 """
 
 from typing import List, Dict, Optional, TypedDict, Any, Callable
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, model_validator
 import numpy as np
 import faiss  # Importa faiss per type hint (opzionale)
 from sentence_transformers import SentenceTransformer
@@ -25,6 +25,8 @@ class UserPreferences(BaseModel):
     vegetarian: bool = Field(description="Vegetarian preference")
     gluten_free: bool = Field(description="Gluten-Free preference")
     lactose_free: bool = Field(description="Lactose-Free preference")
+    use_batch_api: bool = Field(
+        default=False, description="Generate recipes through the OpenAI Batch API (cheaper, asynchronous)")
 
 # --- Strutture Dati ---
 
@@ -57,6 +59,18 @@ class RecipeIngredient(BaseModel):
         description="Nome ingrediente (come trovato nel DB dopo matching)")
     quantity_g: float = Field(description="Quantità in grammi")
 
+    @model_validator(mode="before")
+    @classmethod
+    def _quantity_aliases(cls, data: Any) -> Any:
+        """Accetta anche 'quantity' o 'amount_g' (varianti dell'output LLM) al posto di 'quantity_g'."""
+        if isinstance(data, dict) and "quantity_g" not in data:
+            for alias in ("quantity", "amount_g"):
+                if alias in data:
+                    data = dict(data)
+                    data["quantity_g"] = data[alias]
+                    break
+        return data
+
 
 class CalculatedIngredient(RecipeIngredient):
     """Ingrediente con contributi nutrizionali calcolati."""
@@ -80,6 +94,14 @@ class CalculatedIngredient(RecipeIngredient):
     # Opzionale: tieni traccia del nome LLM originale
     original_llm_name: Optional[str] = None
 
+    @model_validator(mode="before")
+    @classmethod
+    def _default_original_llm_name(cls, data: Any) -> Any:
+        """Se non indicato, il nome originale dell'LLM è il nome dell'ingrediente."""
+        if isinstance(data, dict) and "original_llm_name" not in data and "name" in data:
+            data = {**data, "original_llm_name": data["name"]}
+        return data
+
 
 class FinalRecipeOption(BaseModel):
     """Rappresenta una ricetta finale validata e pronta per l'utente."""
@@ -101,6 +123,23 @@ class FinalRecipeOption(BaseModel):
     # Opzionale: aggiungi score o deviazione per ranking
     cho_deviation_percent: Optional[float] = None
 
+    @model_validator(mode="before")
+    @classmethod
+    def _from_llm_output(cls, data: Any) -> Any:
+        """
+        Accetta direttamente il JSON prodotto dal generatore ('recipe_name' al
+        posto di 'name', flag dietetici e istruzioni opzionali), così la
+        risposta dell'LLM viene validata una sola volta in FinalRecipeOption.
+        """
+        if isinstance(data, dict) and "name" not in data and "recipe_name" in data:
+            data = dict(data)
+            data["name"] = data.pop("recipe_name")
+            data.setdefault("description", "")
+            data.setdefault("instructions", [])
+            for flag in ("is_vegan", "is_vegetarian", "is_gluten_free", "is_lactose_free"):
+                data.setdefault(flag, False)
+        return data
+
 # --- Stato del Grafo LangGraph ---
 
 
@@ -129,6 +168,8 @@ class GraphState(TypedDict, total=False):  # Usa total=False per opzionalità
     # Gestione errori e output
     error_message: Optional[str]
     final_output: Optional[str]
+    # Frammenti HTML prodotti dal formatter (uniti su richiesta da get_final_output)
+    final_output_parts: Optional[List[str]]
 
     # Rimuovi campi relativi a embedding NumPy
     # ingredient_names_list: List[str]      <- Rimosso
@@ -0,0 +1,80 @@
+"""
+Test del generatore che non effettuano chiamate reali all'LLM.
+
+Esecuzione: python -m pytest test_generator_agent.py
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+# Dipendenze importate dal generatore e da model_schema
+pytest.importorskip("pydantic")
+pytest.importorskip("faiss")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("langchain_openai")
+
+from agents import generator_agent
+from agents.generator_agent import _generate_raw_recipes, _stream_json_response
+
+
+class FakeStreamingChain:
+    """Chain finta: emette i chunk dati e registra la chiusura dello stream."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.emitted = 0
+        self.closed = False
+
+    def astream(self, inputs):
+        async def stream():
+            try:
+                for chunk in self.chunks:
+                    self.emitted += 1
+                    yield chunk
+            finally:
+                self.closed = True
+        return stream()
+
+
+def test_stream_json_ignores_braces_and_escapes_inside_strings():
+    chunks = ['  {"recipe_name": "Torta {al} \\"cacao', '\\" }\\\\", ',
+              '"ingredients": [{"name": "Uova"}]}', ' testo dopo', ' e altro']
+    chain = FakeStreamingChain(chunks)
+
+    text = asyncio.run(_stream_json_response(chain, {}))
+
+    # Lo stream si chiude sulla graffa che chiude l'oggetto di primo livello
+    assert text == "".join(chunks[:3])
+    assert chain.emitted == 3
+    assert chain.closed
+
+
+def test_stream_json_rejects_non_json_start():
+    chain = FakeStreamingChain(["Ecco la ricetta: ", '{"recipe_name": "x"}'])
+
+    with pytest.raises(ValueError):
+        asyncio.run(_stream_json_response(chain, {}))
+    assert chain.emitted == 1
+    assert chain.closed
+
+
+def test_generate_raw_recipes_cancels_surplus_generations(monkeypatch):
+    started, cancelled = [], []
+
+    async def fake_single_recipe(generator_chain, recipe_index, retry_budget):
+        started.append(recipe_index)
+        try:
+            # Le prime due generazioni terminano subito, le altre restano in volo
+            await asyncio.sleep(0 if recipe_index < 2 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(recipe_index)
+            raise
+        return SimpleNamespace(name=f"ricetta {recipe_index}")
+
+    monkeypatch.setattr(generator_agent, "generate_single_recipe", fake_single_recipe)
+
+    recipes = asyncio.run(asyncio.wait_for(_generate_raw_recipes(None, 5, 2), timeout=5))
+
+    assert sorted(r.name for r in recipes) == ["ricetta 0", "ricetta 1"]
+    assert sorted(cancelled) == [2, 3, 4]
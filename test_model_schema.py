@@ -0,0 +1,51 @@
+"""
+Test dei validatori di model_schema che accettano l'output JSON del generatore.
+
+Esecuzione: python -m pytest test_model_schema.py
+"""
+import pytest
+
+# Dipendenze importate da model_schema
+pytest.importorskip("pydantic")
+pytest.importorskip("faiss")
+pytest.importorskip("sentence_transformers")
+
+from pydantic import ValidationError
+
+from model_schema import FinalRecipeOption, RecipeIngredient
+
+
+def test_final_recipe_option_accepts_llm_output():
+    recipe = FinalRecipeOption.model_validate({
+        "recipe_name": "Risotto allo zafferano",
+        "ingredients": [{"name": "Riso Carnaroli", "quantity_g": 80}],
+    })
+
+    assert recipe.name == "Risotto allo zafferano"
+    assert recipe.description == ""
+    assert recipe.instructions == []
+    assert not any((recipe.is_vegan, recipe.is_vegetarian,
+                    recipe.is_gluten_free, recipe.is_lactose_free))
+    assert recipe.ingredients[0].original_llm_name == "Riso Carnaroli"
+
+
+def test_final_recipe_option_keeps_explicit_name():
+    recipe = FinalRecipeOption.model_validate({
+        "name": "Nome", "recipe_name": "Altro", "ingredients": [],
+        "is_vegan": True, "is_vegetarian": True,
+        "is_gluten_free": True, "is_lactose_free": True,
+    })
+
+    assert recipe.name == "Nome"
+
+
+@pytest.mark.parametrize("quantity_key", ["quantity_g", "quantity", "amount_g"])
+def test_recipe_ingredient_quantity_aliases(quantity_key):
+    ingredient = RecipeIngredient.model_validate({"name": "Pane", quantity_key: 40})
+
+    assert ingredient.quantity_g == 40
+
+
+def test_recipe_ingredient_missing_quantity_fails_validation():
+    with pytest.raises(ValidationError):
+        RecipeIngredient.model_validate({"name": "Pane"})
@@ -0,0 +1,157 @@
+"""
+Test della logica del verificatore che non richiede indice FAISS né LLM.
+
+Esecuzione: python -m pytest test_verifier_agent.py
+"""
+from itertools import product
+
+import pytest
+
+# Dipendenze importate da model_schema e utils
+pytest.importorskip("pydantic")
+pytest.importorskip("faiss")
+pytest.importorskip("sentence_transformers")
+
+from model_schema import FinalRecipeOption, CalculatedIngredient, IngredientInfo, UserPreferences
+from agents import verifier_agent
+from agents.verifier_agent import (
+    _dietary_mask, _nutrition_totals, analyze_recipe_dietary_properties,
+    check_dietary_compatibility, ensure_recipe_diversity, match_recipe_ingredients)
+
+
+def make_recipe(name, ingredients, total_cho=50.0, flags=(True, True, True, True)):
+    """Ricetta minima: ingredienti come coppie (nome, grammi)."""
+    is_vegan, is_vegetarian, is_gluten_free, is_lactose_free = flags
+    return FinalRecipeOption(
+        name=name,
+        ingredients=[CalculatedIngredient(name=n, quantity_g=q) for n, q in ingredients],
+        total_cho=total_cho,
+        is_vegan=is_vegan, is_vegetarian=is_vegetarian,
+        is_gluten_free=is_gluten_free, is_lactose_free=is_lactose_free,
+        instructions=["Mescolare.", "Servire."])
+
+
+def make_info(name, cho=10.0, flags=(True, True, True, True)):
+    """Voce del database ingredienti con i flag dietetici dati."""
+    is_vegan, is_vegetarian, is_gluten_free, is_lactose_free = flags
+    return IngredientInfo(
+        name=name, cho_per_100g=cho, calories_per_100g=100.0,
+        protein_g_per_100g=2.0, fat_g_per_100g=1.0, fiber_g_per_100g=1.5,
+        is_vegan=is_vegan, is_vegetarian=is_vegetarian,
+        is_gluten_free=is_gluten_free, is_lactose_free=is_lactose_free)
+
+
+def test_nutrition_totals_skips_missing_contributions():
+    ingredients = [
+        CalculatedIngredient(name="Riso", quantity_g=80, cho_contribution=62.4,
+                             calories_contribution=288.0, protein_contribution_g=5.6,
+                             fat_contribution_g=0.4, fiber_contribution_g=1.1),
+        CalculatedIngredient(name="Sale", quantity_g=2),
+        CalculatedIngredient(name="Olio", quantity_g=10, calories_contribution=90.0,
+                             fat_contribution_g=10.0),
+    ]
+
+    assert _nutrition_totals(ingredients) == pytest.approx((62.4, 378.0, 5.6, 10.4, 1.1))
+    assert _nutrition_totals([]) == (0, 0, 0, 0, 0)
+
+
+def test_ensure_recipe_diversity_drops_duplicate_names():
+    """Nomi uguali a meno di maiuscole e spazi: resta la ricetta più vicina al target."""
+    recipes = [
+        make_recipe("Insalata di riso", [("Riso", 80), ("Mais", 50)], total_cho=70.0),
+        make_recipe("insalata  di Riso", [("Farro", 80), ("Piselli", 50)], total_cho=61.0),
+        make_recipe("Vellutata di zucca", [("Zucca", 300), ("Patate", 100)], total_cho=40.0),
+    ]
+
+    # Soglia oltre il massimo della similarità: scarta solo il nome duplicato
+    selected = ensure_recipe_diversity(recipes, target_cho=60.0, similarity_threshold=1.01)
+
+    assert [r.name for r in selected] == ["insalata  di Riso", "Vellutata di zucca"]
+
+
+# --- Correzione fuzzy dei nomi ---
+
+@pytest.fixture
+def fuzzy_ingredient_data(monkeypatch):
+    """DB ridotto e FAISS disattivato: resta solo la correzione fuzzy."""
+    monkeypatch.setattr(verifier_agent, "find_best_match_faiss", lambda **kwargs: None)
+    return {"Zucchine": make_info("Zucchine", cho=2.0), "Polpo": make_info("Polpo", cho=1.0),
+            "Peperone macinato": make_info("Peperone macinato", cho=5.0)}
+
+
+def match_without_faiss(recipe, ingredient_data):
+    return match_recipe_ingredients(
+        recipe, ingredient_data, {}, {}, None, None, None, str.lower)
+
+
+def test_fuzzy_match_corrects_typo(fuzzy_ingredient_data):
+    recipe = make_recipe("Zucchine trifolate", [("zuchine", 200)])
+
+    matched, all_matched = match_without_faiss(recipe, fuzzy_ingredient_data)
+
+    assert all_matched
+    assert [ing.name for ing in matched.ingredients] == ["Zucchine"]
+    assert matched.total_cho == pytest.approx(4.0)
+
+
+def test_fuzzy_match_rejects_different_ingredient(fuzzy_ingredient_data):
+    """'pollo' e 'polpo' hanno similarità 0.8, sotto la soglia: nessuna sostituzione."""
+    recipe = make_recipe("Pollo arrosto", [("pollo", 150)])
+
+    matched, all_matched = match_without_faiss(recipe, fuzzy_ingredient_data)
+
+    assert not all_matched
+    assert matched.ingredients[0].name != "Polpo"
+
+
+def test_fuzzy_match_skips_incompatible_candidate(fuzzy_ingredient_data):
+    """Similarità 0.86, sopra la soglia, ma 'pepe nero' e 'peperone' sono incompatibili."""
+    recipe = make_recipe("Tagliata al pepe", [("pepe nero macinato", 2)])
+
+    matched, all_matched = match_without_faiss(recipe, fuzzy_ingredient_data)
+
+    assert not all_matched
+    assert matched.ingredients[0].name != "Peperone macinato"
+
+
+# --- Flag dietetici a bitmask ---
+
+@pytest.mark.parametrize("recipe_flags", list(product([False, True], repeat=4)))
+@pytest.mark.parametrize("required_flags", list(product([False, True], repeat=4)))
+def test_check_dietary_compatibility_matches_attribute_checks(recipe_flags, required_flags):
+    """Stesso esito della precedente catena di if sui singoli attributi."""
+    recipe = make_recipe("Insalata", [("Lattuga", 100)], flags=recipe_flags)
+    preferences = UserPreferences(
+        target_cho=50, vegan=required_flags[0], vegetarian=required_flags[1],
+        gluten_free=required_flags[2], lactose_free=required_flags[3])
+
+    expected = not any(required and not present
+                       for required, present in zip(required_flags, recipe_flags))
+    assert check_dietary_compatibility(recipe, preferences) is expected
+
+
+def test_dietary_mask_uses_one_bit_per_flag():
+    assert _dietary_mask(False, False, False, False) == 0
+    masks = [_dietary_mask(*(i == bit for i in range(4))) for bit in range(4)]
+    assert len(set(masks)) == 4
+    assert _dietary_mask(True, True, True, True) == sum(masks)
+
+
+def test_analyze_recipe_dietary_properties_ands_ingredient_flags():
+    ingredient_data = {
+        "Riso": make_info("Riso"),
+        "Seitan": make_info("Seitan", flags=(True, True, False, True)),
+        "Uovo": make_info("Uovo", flags=(False, True, True, True)),
+    }
+    recipe = make_recipe("Riso saltato", [("Riso", 80), ("Seitan", 100), ("Uovo", 50)])
+
+    assert analyze_recipe_dietary_properties(recipe, ingredient_data) == (False, True, False, True)
+
+
+def test_analyze_recipe_dietary_properties_checks_names_outside_db():
+    """Per ingredienti assenti dal DB restano i controlli sulle parole chiave."""
+    recipe = make_recipe("Pasta al pollo", [("Pasta di semola", 80), ("Petto di pollo", 120)])
+
+    assert analyze_recipe_dietary_properties(recipe) == (False, False, False, True)
+    assert analyze_recipe_dietary_properties(recipe, {"Riso": make_info("Riso")}) == (
+        False, False, False, True)
@@ -8,7 +8,11 @@ Contiene:
 - Verifica della conformità a preferenze dietetiche
 """
 
+import atexit
+import logging
+import queue
 import re
+from logging.handlers import QueueHandler, QueueListener
 
 from typing import List, Dict, Optional, Tuple, Any, Callable
 
@@ -17,9 +21,70 @@ from sentence_transformers import SentenceTransformer
 # Importa le classi da model_schema se necessario per type hinting
 from model_schema import RecipeIngredient, IngredientInfo, CalculatedIngredient, FinalRecipeOption, UserPreferences
 
+_log = logging.getLogger(__name__)
+
+# Listener del logging applicativo (avviato una sola volta da setup_logging)
+_log_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: int = logging.WARNING) -> None:
+    """Configura una sola volta il logging dell'applicazione.
+
+    I record passano da una coda (QueueHandler) e vengono scritti sul
+    terminale da un thread di background (QueueListener): chi logga non
+    attende l'I/O. Il livello predefinito WARNING silenzia i log per-ricetta
+    a DEBUG. Chiamate successive (es. rerun di Streamlit) non fanno nulla.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(
+        "%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    _log_listener = QueueListener(log_queue, stream_handler)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
+    root_logger = logging.getLogger()
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.setLevel(level)
+
+
 COLOR_WORDS = {'rosso', 'rossa', 'rossi', 'rosse', 'giallo', 'gialla', 'gialli', 'gialle',
                'verde', 'verdi', 'nera', 'nere', 'nero', 'bianchi', 'bianco', 'bianche', 'dorata', 'dorato'}
 
+# Sinonimi usati dal matching FAISS (costanti di modulo, non ricreate a ogni chiamata)
+FAISS_COMMON_SYNONYMS = {
+    "carote": "carota",
+    "gamberi": "gambero",
+    "couscous": "cuscus",
+    "coriandolo": "coriandolo fresco",
+    "peperoni": "peperone",
+    "feta": "formaggio feta",
+    "olive nere": "olive",
+    "formaggio halloumi": "halloumi",
+    "cipolla rossa": "cipolla",
+    "cipolla bianca": "cipolla",
+    "cipolla dorata": "cipolla"
+    # Aggiungi altri sinonimi
+}
+
+# Sinonimi comuni normalizzati usati nel calcolo dei contributi CHO
+CHO_COMMON_SYNONYMS = {
+    "polpo": "polipo",
+    "pomodoro": "pomodori",
+    "pomodori": "pomodoro",
+    "ceci": "cece",
+    "olive": "oliva",
+    "olive nere": "olive",
+    "rucola": "rughetta",
+    "cipolla rossa": "cipolla",
+    "cipolla bianca": "cipolla",
+    "cipolla dorata": "cipolla",
+}
+
 
 def normalize_name(name: str) -> str:
     """Normalizza il nome per il matching (minuscolo, rimuove eccesso spazi).
@@ -47,6 +112,36 @@ def normalize_name(name: str) -> str:
     return normalized_name
 
 
+# Cache a slot singolo del mapping normalizzato per FAISS:
+# (index_to_name_mapping, n_voci, normalize_func, mappa)
+_normalized_index_cache: Optional[Tuple[List[str], int, Callable[[str], str], Dict[str, int]]] = None
+
+
+def _get_normalized_index_mapping(
+    index_to_name_mapping: List[str],
+    normalize_func: Callable[[str], str]
+) -> Dict[str, int]:
+    """Restituisce la mappa nome normalizzato -> primo indice nel mapping FAISS.
+
+    Il mapping viene caricato una volta all'avvio e riusato per ogni
+    ingrediente di ogni ricetta, quindi la mappa (una normalize_func per voce)
+    viene ricostruita solo se cambiano il mapping, la sua lunghezza o la
+    funzione di normalizzazione.
+    """
+    global _normalized_index_cache
+    cached = _normalized_index_cache
+    if (cached is not None and cached[0] is index_to_name_mapping
+            and cached[1] == len(index_to_name_mapping) and cached[2] is normalize_func):
+        return cached[3]
+
+    mapping = {}
+    for idx, name in enumerate(index_to_name_mapping):
+        mapping.setdefault(normalize_func(name), idx)
+    _normalized_index_cache = (index_to_name_mapping, len(
+        index_to_name_mapping), normalize_func, mapping)
+    return mapping
+
+
 def find_best_match_faiss(
     llm_name: str,
     faiss_index: faiss.Index,
@@ -77,38 +172,26 @@ def find_best_match_faiss(
     """
     from ingredient_synonyms import is_incompatible_match
     # PRETRATTAMENTO e NORMALIZZAZIONE
-    common_synonyms = {
-        "carote": "carota",
-        "gamberi": "gambero",
-        "couscous": "cuscus",
-        "coriandolo": "coriandolo fresco",
-        "peperoni": "peperone",
-        "feta": "formaggio feta",
-        "olive nere": "olive",
-        "formaggio halloumi": "halloumi",
-        "cipolla rossa": "cipolla",
-        "cipolla bianca": "cipolla",
-        "cipolla dorata": "cipolla"
-        # Aggiungi altri sinonimi
-    }
+    common_synonyms = FAISS_COMMON_SYNONYMS
 
     # Normalizza input
     normalized_llm = normalize_func(llm_name)
 
-    # Crea versione normalizzata del mapping
-    normalized_index_mapping = [normalize_func(
-        name) for name in index_to_name_mapping]
+    # Mapping normalizzato: nome normalizzato -> primo indice (lookup O(1)),
+    # costruito una sola volta per mapping invece che a ogni ingrediente
+    normalized_index_mapping = _get_normalized_index_mapping(
+        index_to_name_mapping, normalize_func)
 
     # 1. TENTATIVO 1: Corrispondenza diretta o tramite sinonimo noto
-    if normalized_llm in normalized_index_mapping:
-        exact_index = normalized_index_mapping.index(normalized_llm)
+    exact_index = normalized_index_mapping.get(normalized_llm)
+    if exact_index is not None:
         return index_to_name_mapping[exact_index], 1.0
 
     if normalized_llm in common_synonyms:
         synonym = common_synonyms[normalized_llm]
         normalized_synonym = normalize_func(synonym)
-        if normalized_synonym in normalized_index_mapping:
-            synonym_index = normalized_index_mapping.index(normalized_synonym)
+        synonym_index = normalized_index_mapping.get(normalized_synonym)
+        if synonym_index is not None:
             return index_to_name_mapping[synonym_index], 0.95
 
     # 2. TENTATIVO 2: Matching FAISS standard
@@ -133,8 +216,8 @@ def find_best_match_faiss(
 
                 # Verifica se la corrispondenza è incompatibile
                 if is_incompatible_match(llm_name, matched_name):
-                    print(
-                        f"Match incompatibile rilevato e ignorato: '{llm_name}' -> '{matched_name}'")
+                    _log.debug(
+                        "Match incompatibile rilevato e ignorato: '%s' -> '%s'", llm_name, matched_name)
                     continue  # Prova con il prossimo match
 
                 return matched_name, float(match_score)
@@ -159,11 +242,32 @@ def find_best_match_faiss(
 
         return None
     except Exception as e:
-        print(
-            f"Errore durante la ricerca FAISS avanzata per '{llm_name}': {e}")
+        _log.warning(
+            "Errore durante la ricerca FAISS avanzata per '%s': %s", llm_name, e)
         return None
 
 
+# Cache a slot singolo della mappa normalizzata: (ingredient_data, n_voci, mappa)
+_normalized_lookup_cache: Optional[Tuple[Dict[str, IngredientInfo], int, Dict[str, str]]] = None
+
+
+def _get_normalized_lookup(ingredient_data: Dict[str, IngredientInfo]) -> Dict[str, str]:
+    """Restituisce la mappa nome normalizzato -> nome originale per il DB dato.
+
+    Il DB ingredienti viene caricato una volta e riusato per tutte le ricette,
+    quindi la mappa (una normalize_name per ogni voce) viene ricostruita solo
+    se cambia il dizionario o il suo numero di voci.
+    """
+    global _normalized_lookup_cache
+    cached = _normalized_lookup_cache
+    if cached is not None and cached[0] is ingredient_data and cached[1] == len(ingredient_data):
+        return cached[2]
+
+    lookup = {normalize_name(name): name for name in ingredient_data}
+    _normalized_lookup_cache = (ingredient_data, len(ingredient_data), lookup)
+    return lookup
+
+
 def calculate_ingredient_cho_contribution(
     ingredients: List[RecipeIngredient],
     ingredient_data: Dict[str, IngredientInfo]
@@ -185,29 +289,11 @@ def calculate_ingredient_cho_contribution(
     """
     calculated_list = []
 
-    # Crea un dizionario case-insensitive per il matching
-    lowercase_to_original = {}
-    for name in ingredient_data.keys():
-        lowercase_to_original[normalize_name(name)] = name
-
-    # Crea un dizionario normalizzato dei dati degli ingredienti
-    normalized_ingredient_data = {}
-    for name, info in ingredient_data.items():
-        normalized_ingredient_data[normalize_name(name)] = info
+    # Dizionario nome normalizzato -> nome originale (calcolato una volta per DB)
+    lowercase_to_original = _get_normalized_lookup(ingredient_data)
 
     # Sinonimi comuni normalizzati
-    common_synonyms = {
-        "polpo": "polipo",
-        "pomodoro": "pomodori",
-        "pomodori": "pomodoro",
-        "ceci": "cece",
-        "olive": "oliva",
-        "olive nere": "olive",
-        "rucola": "rughetta",
-        "cipolla rossa": "cipolla",
-        "cipolla bianca": "cipolla",
-        "cipolla dorata": "cipolla",
-    }
+    common_synonyms = CHO_COMMON_SYNONYMS
 
     for ing in ingredients:
         # Normalizza sempre il nome dell'ingrediente
@@ -215,14 +301,14 @@ def calculate_ingredient_cho_contribution(
         ingredient_key = None
 
         # Match diretto con nome normalizzato
-        if normalized_name in normalized_ingredient_data:
+        if normalized_name in lowercase_to_original:
             ingredient_key = lowercase_to_original[normalized_name]
 
         # Se non trovato, prova sinonimi comuni
         if not ingredient_key and normalized_name in common_synonyms:
             synonym = common_synonyms[normalized_name]
             normalized_synonym = normalize_name(synonym)
-            if normalized_synonym in normalized_ingredient_data:
+            if normalized_synonym in lowercase_to_original:
                 ingredient_key = lowercase_to_original[normalized_synonym]
 
         # Se ancora non trovato, prova variazioni singolare/plurale
@@ -267,8 +353,11 @@ def calculate_ingredient_cho_contribution(
             fiber = (info.fiber_g_per_100g / 100.0) * \
                 ing.quantity_g if info.fiber_g_per_100g is not None else None
 
+            # Valori calcolati qui e già tipizzati (info dal DB validato, quantità
+            # dalla ricetta validata): model_construct evita di ripassare dalla
+            # validazione Pydantic
             calculated_list.append(
-                CalculatedIngredient(
+                CalculatedIngredient.model_construct(
                     name=ing.name,
                     quantity_g=ing.quantity_g,
                     cho_per_100g=cho_per_100g,
@@ -296,11 +385,11 @@ def calculate_ingredient_cho_contribution(
                 )
             )
         else:
-            print(
-                f"Attenzione (utils): Info ingrediente '{ing.name}' non trovate durante calcolo CHO.")
+            _log.warning(
+                "Info ingrediente '%s' non trovate durante calcolo CHO.", ing.name)
             # Aggiungi un placeholder
             calculated_list.append(
-                CalculatedIngredient(
+                CalculatedIngredient.model_construct(
                     name=f"{ing.name} (Info Mancanti!)",
                     quantity_g=ing.quantity_g,
                     cho_contribution=0.0,